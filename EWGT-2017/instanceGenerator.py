@@ -1,8 +1,9 @@
 from enum import Enum
+from operator import attrgetter
 from random import randint
 import copy
 import locale
-import math
+import numpy
 import os
 
 
@@ -83,37 +84,22 @@ class Generator ():
         endDepots = []
         for i in range(self.nmbStartDepots):
             startDepot = self.__createRandomNode(NodeType.StartDepot)
-            inst.nodes.append(startDepot)
+            inst.addNode(startDepot)
 
             endDepot = copy.deepcopy(startDepot)
             endDepot.type = NodeType.EndDepot
             endDepots.append(endDepot)
         for i in range(self.nmbCustomers):
-            inst.nodes.append(self.__createRandomNode(NodeType.Customer))
+            inst.addNode(self.__createRandomNode(NodeType.Customer))
         for i in range(self.nmbRechargingStations):
+            # each recharging station is stored once and only replicated when the instance is serialized
             rechargingStationNode = self.__createRandomNode(NodeType.RechargingStation)
-            for i in range(nmbRechargingStationDuplications):
-                inst.nodes.append(rechargingStationNode)
-        inst.nodes.extend(endDepots)
+            inst.addNode(rechargingStationNode, nmbRechargingStationDuplications)
+        for endDepot in endDepots:
+            inst.addNode(endDepot)
 
         # generate move options (i.e. edges in the graph underlying the VRP - the distance and cost matrix)
-        for fromIndex, fromNode in enumerate(inst.nodes):
-            for toIndex, toNode in enumerate(inst.nodes):
-                for motIndex, mot in enumerate(inst.modesOfTransport):
-                    option = MoveOption()
-
-                    option.fromNode = fromIndex
-                    option.toNode = toIndex
-                    option.modeOfTransport = motIndex
-
-                    d = fromNode.getFlightDistance(toNode) * mot.slopingFactor
-                    emissions = d * mot.emissionsPerDistance
-
-                    option.distance = d
-                    option.duration = d * mot.durationPerDistance + mot.overheadDuration
-                    option.cost = d * mot.costPerDistance + option.duration * mot.costPerTime + emissions * self.costPerUnitOfEmission
-
-                    inst.moveOptions.append(option)
+        inst.moveOptions = self.__createMoveOptions(inst.physicalNodes, inst.modesOfTransport, inst.getPhysicalNodeIndices())
 
         probabilityRangeInPercent = RandomRange(1, 100)
 
@@ -166,6 +152,23 @@ class Generator ():
         return inst
 
 
+    def __createMoveOptions(self, nodes, modesOfTransport, physicalNodeIndices):
+        """ Computes the move options for all pairs of physical nodes and all modes of transport at once from coordinate vectors """
+        x = numpy.array([n.coordinateX for n in nodes], dtype=float)
+        y = numpy.array([n.coordinateY for n in nodes], dtype=float)
+        diffX = x[:, None] - x[None, :]
+        diffY = y[:, None] - y[None, :]
+        flightDistance = numpy.sqrt(diffX*diffX + diffY*diffY)
+
+        def motVector(attribute):
+            return numpy.array([getattr(mot, attribute) for mot in modesOfTransport], dtype=float)
+
+        d = flightDistance[:, :, None] * motVector("slopingFactor")
+        emissions = d * motVector("emissionsPerDistance")
+        duration = d * motVector("durationPerDistance") + motVector("overheadDuration")
+        cost = d * motVector("costPerDistance") + duration * motVector("costPerTime") + emissions * self.costPerUnitOfEmission
+        return MoveOptionTable(d, duration, cost, physicalNodeIndices)
+
     def __createRandomNode(self, type):
         """ Creates a random node of a given type with coordinates, a time window and a serive time. """
         n = Node()
@@ -193,26 +196,48 @@ class RandomRange:
     def get(self):
         return randint(self.min, self.max)
 
+csvSchemas = {} # class -> (members, getter returning the tuple of member values)
+
 class CSVSerializable:
     """Provides a base class for classes that represent lines in csv files """
 
     def getCSVHeader(self):
-        return ";".join(self.__getMembers())
+        return ";".join(self.__getSchema()[0])
     def getCSVLine(self):
-        return ";".join(str(getattr(self, m)) for m in self.__getMembers())
+        return ";".join(map(str, self.getCSVValues()))
+    def getCSVValues(self):
+        """ Returns the values of the members of this object in the order of the csv header """
+        return self.__getSchema()[1](self)
+    def __getSchema(self):
+        """ Returns the members of this class and a getter for their values, determined once per class """
+        schema = csvSchemas.get(type(self))
+        if schema is None:
+            members = self.__getMembers()
+            getter = attrgetter(*members) if len(members) > 1 else lambda o: tuple(getattr(o, m) for m in members)
+            schema = csvSchemas[type(self)] = (members, getter)
+        return schema
     def __getMembers(self):
-        """ Returns the list of members of this object """
-        return [attr for attr in dir(self) if not callable(getattr(self, attr)) and not attr.startswith("__")]
-
-def getCSV(listOfSerializables):
-    """ Returns a string containing a csv file that represents a list of csv-serializable objects. """
-    if len(listOfSerializables) == 0:
-        return ""
-    return listOfSerializables[0].getCSVHeader() + "\n" + "\n".join([e.getCSVLine() for e in listOfSerializables])
-
-def writeFile(filename, string):
-    """ Writes the given string to a file. """
-    open(filename, 'w').write(string)
+        """ Returns the sorted list of members declared by the constructor of this class,
+            so attributes added to single objects later do not change the csv schema
+        """
+        declared = vars(type(self)())
+        return sorted(attr for attr, value in declared.items() if not callable(value) and not attr.startswith("__"))
+
+def getCSVLines(listOfSerializables):
+    """ Returns the csv header and an iterator over the csv lines of a non-empty list of csv-serializable objects. """
+    if isinstance(listOfSerializables, MoveOptionTable):
+        return listOfSerializables.getCSVHeader(), listOfSerializables.getCSVLines()
+    return listOfSerializables[0].getCSVHeader(), (e.getCSVLine() for e in listOfSerializables)
+
+def writeCSV(filename, listOfSerializables):
+    """ Writes a csv file that represents a list of csv-serializable objects line by line to a buffered file. """
+    with open(filename, 'w', buffering=1024 * 1024) as f:
+        if len(listOfSerializables) > 0:
+            header, lines = getCSVLines(listOfSerializables)
+            f.write(header)
+            for line in lines:
+                f.write("\n")
+                f.write(line)
     print("wrote: " + filename)
 
 class NodeType(Enum):
@@ -230,11 +255,6 @@ class Node (CSVSerializable):
         self.serviceDuration = -1
         self.type = NodeType.StartDepot
 
-    def getFlightDistance(self, other):
-        diffX = self.coordinateX - other.coordinateX
-        diffY = self.coordinateY - other.coordinateY
-        return math.sqrt(diffX*diffX + diffY*diffY)
-
 class MoveOption (CSVSerializable):
     """ Represents a matrix entry which specifies a possibility to move from fromLocation to toLocation. """
     def __init__(self):
@@ -245,6 +265,62 @@ class MoveOption (CSVSerializable):
         self.duration = 0
         self.cost = 0
 
+class MoveOptionTable:
+    """ Represents all move options as (fromNode x toNode x modeOfTransport) arrays of distances, durations and costs
+        between physical nodes. physicalNodeIndices maps the index of each (possibly replicated) node of the instance
+        to its physical node. Iterating or indexing yields MoveOption objects of the instance nodes
+        in the order fromNode, toNode, modeOfTransport.
+    """
+    def __init__(self, distance, duration, cost, physicalNodeIndices):
+        self.distance = distance
+        self.duration = duration
+        self.cost = cost
+        self.physicalNodeIndices = physicalNodeIndices
+
+    def getShape(self):
+        nmbNodes = len(self.physicalNodeIndices)
+        return (nmbNodes, nmbNodes, self.cost.shape[2])
+
+    def __len__(self):
+        nmbNodes, _, nmbMots = self.getShape()
+        return nmbNodes * nmbNodes * nmbMots
+
+    def __getitem__(self, index):
+        fromNode, toNode, modeOfTransport = numpy.unravel_index(index, self.getShape())
+        i, j = self.physicalNodeIndices[fromNode], self.physicalNodeIndices[toNode]
+        option = MoveOption()
+        option.fromNode = int(fromNode)
+        option.toNode = int(toNode)
+        option.modeOfTransport = int(modeOfTransport)
+        option.distance = float(self.distance[i, j, modeOfTransport])
+        option.duration = float(self.duration[i, j, modeOfTransport])
+        option.cost = float(self.cost[i, j, modeOfTransport])
+        return option
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def getColumns(self, fromNode):
+        """ Returns the columns of the csv representation of all move options starting at fromNode as flat arrays,
+            in the column order of MoveOption
+        """
+        nmbNodes, _, nmbMots = self.getShape()
+        i, j = self.physicalNodeIndices[fromNode], self.physicalNodeIndices
+        toNode, modeOfTransport = numpy.indices((nmbNodes, nmbMots)).reshape(2, -1)
+        columns = {"fromNode": numpy.full(toNode.size, fromNode), "toNode": toNode, "modeOfTransport": modeOfTransport,
+                   "distance": self.distance[i, j].ravel(), "duration": self.duration[i, j].ravel(), "cost": self.cost[i, j].ravel()}
+        return {name: columns[name] for name in MoveOption().getCSVHeader().split(";")}
+
+    def getCSVHeader(self):
+        return MoveOption().getCSVHeader()
+
+    def getCSVLines(self):
+        """ Yields the csv lines of all move options, replicated nodes are expanded one row of the matrix at a time """
+        for fromNode in range(len(self.physicalNodeIndices)):
+            for row in zip(*(c.tolist() for c in self.getColumns(fromNode).values())):
+                yield ";".join(map(str, row))
+
 class ModeOfTransport (CSVSerializable):
     def __init__(self):
         self.name = "default"
@@ -294,15 +370,30 @@ class ModeOfTransportTypeSummary (CSVSerializable):
 class Instance ():
     def __init__(self):
         self.name = "default-instance"
-        self.nodes = []
+        self.physicalNodes = []
+        self.nodeReplications = []
         self.modesOfTransport = []
         self.moveOptions = []
         self.motDependentNodeInfos = []
         self.userDependentNodeInfos = []
         self.general = []
 
-    def store(self, basedir):
-        """ Stores the instances under the given directory """
+    def addNode(self, node, replications=1):
+        """ Adds a node that occurs replications times (with consecutive indices) in the instance """
+        self.physicalNodes.append(node)
+        self.nodeReplications.append(replications)
+
+    @property
+    def nodes(self):
+        """ The nodes of the instance with replicated nodes expanded """
+        return [n for n, r in zip(self.physicalNodes, self.nodeReplications) for i in range(r)]
+
+    def getPhysicalNodeIndices(self):
+        """ Returns the index of the physical node for each node index """
+        return numpy.repeat(numpy.arange(len(self.physicalNodes)), self.nodeReplications)
+
+    def store(self, basedir, binary=False):
+        """ Stores the instances under the given directory, with binary=True additionally as memory-mappable .npy columns """
 
         dir = basedir + "\\" + self.name
         if not os.path.exists(dir):
@@ -324,27 +415,83 @@ class Instance ():
             motTypeSummary.append(s)
 
         nmbMots = len(self.modesOfTransport)
-        nmbNodes = len(self.nodes)
+        nmbNodes = sum(self.nodeReplications)
         nmbUsers = self.general[0].nmbUsers
 
-        writeFile(dir + "\\nodes.csv", getCSV(self.nodes))
-        writeFile(dir + "\\modesOfTransport.csv", getCSV(self.modesOfTransport))
-        writeFile(dir + "\\moveOptions.csv", getCSV(self.moveOptions))
-        writeFile(dir + "\\motDependentNodeInfos.csv", getCSV(self.motDependentNodeInfos))
-        writeFile(dir + "\\motDependentNodeInfos-isReachable.csv", getMatrixCSV(nmbMots, nmbNodes, lambda r, c: self.motDependentNodeInfos[r*nmbNodes+c].isReachable))
-        writeFile(dir + "\\motDependentNodeInfos-nmbVehicles.csv", getMatrixCSV(nmbMots, nmbNodes, lambda r, c: self.motDependentNodeInfos[r*nmbNodes+c].nmbVehicles))
-        writeFile(dir + "\\motDependentNodeInfos-rechargingCost.csv", getMatrixCSV(nmbMots, nmbNodes, lambda r, c: self.motDependentNodeInfos[r*nmbNodes+c].rechargingCost))
-        writeFile(dir + "\\userDependentNodeInfos.csv", getCSV(self.userDependentNodeInfos))
-        writeFile(dir + "\\userDependentNodeInfos-isVisitingAllowed.csv", getMatrixCSV(nmbNodes, nmbUsers, lambda r, c: self.userDependentNodeInfos[r*nmbUsers+c].isVisitingAllowed))
-        writeFile(dir + "\\modeOfTransportTypeSummary.csv", getCSV(motTypeSummary))
-        writeFile(dir + "\\general.csv", getCSV(self.general))
-
-def getMatrixCSV(nmbRows, nmbColumns, matrix):
-    """ Returns a string representing a given matrix using a csv format (comma separated values) """
-    result = ""
-    for r in range(nmbRows):
-        result += ';'.join([str(matrix(r, c)) for c in range(nmbColumns)]) + "\n"
-    return result
+        matrices = {
+            "motDependentNodeInfos-isReachable": getMatrix(self.motDependentNodeInfos, "isReachable", nmbMots, nmbNodes),
+            "motDependentNodeInfos-nmbVehicles": getMatrix(self.motDependentNodeInfos, "nmbVehicles", nmbMots, nmbNodes),
+            "motDependentNodeInfos-rechargingCost": getMatrix(self.motDependentNodeInfos, "rechargingCost", nmbMots, nmbNodes),
+            "userDependentNodeInfos-isVisitingAllowed": getMatrix(self.userDependentNodeInfos, "isVisitingAllowed", nmbNodes, nmbUsers)
+        }
+
+        writeCSV(dir + "\\nodes.csv", self.nodes)
+        writeCSV(dir + "\\modesOfTransport.csv", self.modesOfTransport)
+        writeCSV(dir + "\\moveOptions.csv", self.moveOptions)
+        writeCSV(dir + "\\motDependentNodeInfos.csv", self.motDependentNodeInfos)
+        writeMatrixCSV(dir + "\\motDependentNodeInfos-isReachable.csv", matrices["motDependentNodeInfos-isReachable"])
+        writeMatrixCSV(dir + "\\motDependentNodeInfos-nmbVehicles.csv", matrices["motDependentNodeInfos-nmbVehicles"])
+        writeMatrixCSV(dir + "\\motDependentNodeInfos-rechargingCost.csv", matrices["motDependentNodeInfos-rechargingCost"])
+        writeCSV(dir + "\\userDependentNodeInfos.csv", self.userDependentNodeInfos)
+        writeMatrixCSV(dir + "\\userDependentNodeInfos-isVisitingAllowed.csv", matrices["userDependentNodeInfos-isVisitingAllowed"])
+        writeCSV(dir + "\\modeOfTransportTypeSummary.csv", motTypeSummary)
+        writeCSV(dir + "\\general.csv", self.general)
+
+        if binary:
+            self.storeBinary(dir, matrices)
+
+    def storeBinary(self, dir, matrices):
+        """ Stores the nodes, the move options and the node info matrices as .npy files with fixed dtypes,
+            one file per column or matrix, which can be memory-mapped by loadBinary
+        """
+        for name, column in getColumns(self.nodes).items():
+            writeNPY(dir + "\\nodes-" + name + ".npy", column)
+        writeNPY(dir + "\\moveOptions-distance.npy", self.moveOptions.distance)
+        writeNPY(dir + "\\moveOptions-duration.npy", self.moveOptions.duration)
+        writeNPY(dir + "\\moveOptions-cost.npy", self.moveOptions.cost)
+        writeNPY(dir + "\\moveOptions-physicalNodeIndices.npy", self.moveOptions.physicalNodeIndices)
+        for name, matrix in matrices.items():
+            writeNPY(dir + "\\" + name + ".npy", matrix)
+
+binaryNodeInfoMatrices = ["motDependentNodeInfos-isReachable", "motDependentNodeInfos-nmbVehicles",
+                          "motDependentNodeInfos-rechargingCost", "userDependentNodeInfos-isVisitingAllowed"]
+
+def loadBinary(dir):
+    """ Memory-maps the binary files of an instance stored with binary=True.
+        Returns the move options as MoveOptionTable and a dictionary of the node columns (by "nodes-" + member name)
+        and the node info matrices (by the name of their csv file)
+    """
+    def load(name):
+        return numpy.load(dir + "\\" + name + ".npy", mmap_mode="r")
+
+    moveOptions = MoveOptionTable(load("moveOptions-distance"), load("moveOptions-duration"), load("moveOptions-cost"),
+                                  load("moveOptions-physicalNodeIndices"))
+    names = ["nodes-" + name for name in Node().getCSVHeader().split(";")] + binaryNodeInfoMatrices
+    return moveOptions, {name: load(name) for name in names}
+
+def getColumns(listOfSerializables):
+    """ Returns the members of a non-empty list of csv-serializable objects as arrays by member name, enums by their value """
+    header = listOfSerializables[0].getCSVHeader().split(";")
+    columns = {}
+    for name, values in zip(header, zip(*(e.getCSVValues() for e in listOfSerializables))):
+        columns[name] = numpy.array([v.value if isinstance(v, Enum) else v for v in values])
+    return columns
+
+def writeNPY(filename, array):
+    """ Writes an array to a .npy file which can be memory-mapped again """
+    numpy.save(filename, numpy.ascontiguousarray(array))
+    print("wrote: " + filename)
+
+def getMatrix(infos, attribute, nmbRows, nmbColumns):
+    """ Returns an (nmbRows x nmbColumns) array of the given attribute of a row-major list of node infos """
+    return numpy.array([getattr(i, attribute) for i in infos]).reshape(nmbRows, nmbColumns)
+
+def writeMatrixCSV(filename, matrix):
+    """ Writes a given matrix using a csv format (comma separated values) row by row to a buffered file """
+    with open(filename, 'w', buffering=1024 * 1024) as f:
+        for row in matrix.tolist():
+            f.write(';'.join(map(str, row)) + "\n")
+    print("wrote: " + filename)
 
 def createModeOfTransportList():
     """ Creates a list of ModeOfTransport objects including
@@ -538,8 +685,9 @@ class GeneratorException (BaseException):
     """ An exception that can be thrown by the instance generator """
     pass
 
-try:
-    run()
-except GeneratorException as e:
-    print ("\nError: " + str(e) + "\n")
+if __name__ == "__main__":
+    try:
+        run()
+    except GeneratorException as e:
+        print ("\nError: " + str(e) + "\n")
 
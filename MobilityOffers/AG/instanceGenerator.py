@@ -1,9 +1,14 @@
 from enum import Enum
 from random import randint
-import copy
+import argparse
+import itertools
 import locale
 import math
+import multiprocessing
+import numpy
 import os
+import random
+import time
 
 
 INSTANCE_DIRECTORY = "./instances"
@@ -11,22 +16,61 @@ INSTANCE_FILE_ENDING = ".mo.input"
 
 TIME_HORIZON = 24 * 7 * 4 # horizon for order creation dates (away periods can be afterwards)
 
+DEMAND_BLOCK_SIZE = 256 # number of demands drawn at once by the vectorized generator
 
-def run():
-    ensurePathExistsAndEmpty(INSTANCE_DIRECTORY)
-    gen = Generator()
-    for gen.nmbDemands in [200, 1000, 2000, 5000 ]:
-        for gen.longDurationProbability in [ 1, 2, 5 ]:
-            for fleetUtilization in [ 20, 40, 60, 80 ]:
-                expectedOverallVehicleUsageDuration = gen.getAverageAwayPeriodDuration() * gen.nmbDemands
-                extendedTimeHorizon = TIME_HORIZON + gen.twStartRange.max + gen.longDurationRange.max
-                minNmbVehiclesIfUtilizationIsMaximal = expectedOverallVehicleUsageDuration / extendedTimeHorizon
-                gen.nmbVehicles = minNmbVehiclesIfUtilizationIsMaximal * 100 / fleetUtilization
-                for gen.vehicleUsageProbability in [ 40, 60, 80 ]:
-                    instanceName = "d" + str(gen.nmbDemands) + "l" + str(gen.longDurationProbability) + "f" + str(fleetUtilization) + "p" + str(gen.vehicleUsageProbability)
-                    filename = os.path.join(INSTANCE_DIRECTORY, instanceName + INSTANCE_FILE_ENDING)
-                    gen.generate(filename)
 
+def getParameterGrid():
+    """ Returns the (nmbDemands, longDurationProbability, fleetUtilization, vehicleUsageProbability) combinations of the benchmark set """
+    return list(itertools.product([200, 1000, 2000, 5000], [1, 2, 5], [20, 40, 60, 80], [40, 60, 80]))
+
+def generateInstance(parameters, seed=None, vectorized=True):
+    """ Generates the instance of one parameter combination, seeding the random number generator with seed if given.
+        Returns the name of the instance and the time it took to generate it.
+    """
+    start = time.time()
+    if seed is not None:
+        random.seed(seed)
+    gen = Generator()
+    gen.vectorized = vectorized
+    gen.rng = numpy.random.default_rng(seed)
+    gen.nmbDemands, gen.longDurationProbability, fleetUtilization, gen.vehicleUsageProbability = parameters
+    expectedOverallVehicleUsageDuration = gen.getAverageAwayPeriodDuration() * gen.nmbDemands
+    extendedTimeHorizon = TIME_HORIZON + gen.twStartRange.max + gen.longDurationRange.max
+    minNmbVehiclesIfUtilizationIsMaximal = expectedOverallVehicleUsageDuration / extendedTimeHorizon
+    gen.nmbVehicles = minNmbVehiclesIfUtilizationIsMaximal * 100 / fleetUtilization
+    instanceName = "d" + str(gen.nmbDemands) + "l" + str(gen.longDurationProbability) + "f" + str(fleetUtilization) + "p" + str(gen.vehicleUsageProbability)
+    filename = os.path.join(INSTANCE_DIRECTORY, instanceName + INSTANCE_FILE_ENDING)
+    gen.generate(filename)
+    return instanceName, time.time() - start
+
+def _generateInstance(task):
+    return generateInstance(*task)
+
+def run(processes=1, seed=None, vectorized=True):
+    """ Generates all instances of the parameter grid, using a pool of worker processes if processes is not 1.
+        Each parameter combination gets its own seed (seed + index of the combination) if a seed is given;
+        parallel runs always need one, so it is drawn randomly if missing.
+    """
+    ensurePathExistsAndEmpty(INSTANCE_DIRECTORY)
+    grid = getParameterGrid()
+    if processes != 1 and seed is None:
+        seed = randint(0, 2 ** 31)
+    seeds = [None if seed is None else seed + i for i in range(len(grid))]
+    tasks = [(parameters, seed, vectorized) for parameters, seed in zip(grid, seeds)]
+    if seed is not None:
+        print("seed: " + str(seed))
+
+    start = time.time()
+    if processes == 1:
+        printResults(map(_generateInstance, tasks), len(tasks))
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            printResults(pool.imap_unordered(_generateInstance, tasks), len(tasks))
+    print("generated " + str(len(tasks)) + " instances in " + "{:.2f}".format(time.time() - start) + "s")
+
+def printResults(results, nmbTasks):
+    for i, (instanceName, duration) in enumerate(results):
+        print("[" + str(i + 1) + "/" + str(nmbTasks) + "] " + instanceName + " generated in " + "{:.2f}".format(duration) + "s")
 
 class Generator():
     def __init__(self):
@@ -64,6 +108,10 @@ class Generator():
 
         self.probabilityRange = RandomRange(0, 100)
 
+        # draw whole blocks of demands with numpy instead of one random number after the other
+        self.vectorized = True
+        self.rng = numpy.random.default_rng()
+
     def getAverageAwayPeriodDuration(self):
         shortDurationProbability = 100 - self.longDurationProbability
         shortPart = self.shortDurationRange.getExpectedValue() * shortDurationProbability
@@ -97,10 +145,88 @@ class Generator():
             v.nmbVehicles = math.ceil(self.nmbVehicles * v.percentageOfFleet / 100)
             currentVehicleIndex = currentVehicleIndex + v.nmbVehicles
 
-        f = open(filename, 'w')
-        f.write(str(currentVehicleIndex) + " " + str(self.nmbDemands) + "\n")
-        for i in range(self.nmbDemands):
-            f.write(" ".join(self.createRandomDemand()) + "\n")
+        with open(filename, 'w') as f:
+            f.write(str(currentVehicleIndex) + " " + str(self.nmbDemands) + "\n")
+            if self.vectorized:
+                for first in range(0, self.nmbDemands, DEMAND_BLOCK_SIZE):
+                    f.writelines(self.createRandomDemandBlock(min(DEMAND_BLOCK_SIZE, self.nmbDemands - first)))
+            else:
+                for i in range(self.nmbDemands):
+                    f.write(" ".join(self.createRandomDemand()) + "\n")
+
+    def createRandomDemandBlock(self, nmbDemands):
+        """ Returns the lines of nmbDemands mobility demands including their mobility offers
+            according to the file format description. All random numbers of the block are drawn
+            at once from self.rng, following the same distributions as createRandomDemand.
+        """
+        rng = self.rng
+        maxNmbAwayPeriods = self.nmbAwayPeriodsRange.max
+        nmbVehicleTypes = len(self.vehicleTypes)
+
+        # per demand
+        demandCreationDate = self.demandCreationRange.getArray(rng, nmbDemands)
+        isLong = self.probabilityRange.getArray(rng, nmbDemands) <= self.longDurationProbability
+        baseDuration = numpy.where(isLong, self.longDurationRange.getArray(rng, nmbDemands), self.shortDurationRange.getArray(rng, nmbDemands))
+        baseCostFactor = self.costPerTimeRange.getArray(rng, nmbDemands)
+        nmbAwayPeriods = self.nmbAwayPeriodsRange.getArray(rng, nmbDemands)
+
+        # per demand and away period
+        shape = (nmbDemands, maxNmbAwayPeriods)
+        isAwayPeriod = numpy.arange(maxNmbAwayPeriods) < nmbAwayPeriods[:, None]
+        baseStartDate = demandCreationDate[:, None] + self.twStartRange.getUniqueArray(rng, nmbDemands, maxNmbAwayPeriods)
+        cumulatedPercentages = numpy.cumsum([v.percentageOfFleet for v in self.vehicleTypes])
+        minVehicleTypeIndex = numpy.searchsorted(cumulatedPercentages, RandomRange(0, cumulatedPercentages[-1]).getArray(rng, shape))
+        costFactors = numpy.array([v.costFactor for v in self.vehicleTypes])
+        creation, start, duration, costFactor = demandCreationDate[:, None], baseStartDate, baseDuration[:, None], baseCostFactor[:, None]
+
+        # per demand, away period and vehicle type
+        typeOffers = self.createRandomOfferArrays(creation[:, :, None], start[:, :, None], duration[:, :, None],
+                                                  self.twDueDateRangeMaxVehicle, shape + (nmbVehicleTypes,))
+        typeOffers[0] = (typeOffers[2] - typeOffers[1]) * costFactors * costFactor[:, :, None]
+
+        # per demand, away period and vehicle
+        vehicleTypeIndex = numpy.repeat(numpy.arange(nmbVehicleTypes), [v.nmbVehicles for v in self.vehicleTypes])
+        isPreferred = vehicleTypeIndex == minVehicleTypeIndex[:, :, None]
+        usageProbability = numpy.where(isPreferred, self.vehicleUsageProbability, self.vehicleUsageProbabilityOfNonPreferredVehicleType)
+        isUsed = self.probabilityRange.getArray(rng, shape + (len(vehicleTypeIndex),)) <= usageProbability
+        isUsed &= (vehicleTypeIndex >= minVehicleTypeIndex[:, :, None]) & isAwayPeriod[:, :, None]
+        d, a, v = numpy.nonzero(isUsed)
+        offers = [numpy.vstack([typeOffers[:, d, a, vehicleTypeIndex[v]], v])]
+        keys = [(d, a, v)]
+
+        # non-vehicle offers A and B
+        costFactorOfMinVehicleType = costFactors[minVehicleTypeIndex]
+        nonVehicle = [(self.probabilityNonVehicleA, self.twDueDateRangeMaxNonVehicleA, self.relativeCostOfNonVehicleA),
+                      (self.probabilityNonVehicleB, self.twDueDateRangeMaxNonVehicleB, self.relativeCostOfNonVehicleB)]
+        for k, (probability, dueDateRangeMax, relativeCost) in enumerate(nonVehicle):
+            isOffered = (self.probabilityRange.getArray(rng, shape) <= probability) & isAwayPeriod
+            o = self.createRandomOfferArrays(creation, start, duration, dueDateRangeMax, shape)
+            o[0] = (o[2] - o[1]) * costFactorOfMinVehicleType * costFactor * relativeCost.getArray(rng, shape) // 100
+            d, a = numpy.nonzero(isOffered)
+            offers.append(numpy.vstack([o[:, d, a], numpy.full(len(d), -1)]))
+            keys.append((d, a, numpy.full(len(d), len(vehicleTypeIndex) + k)))
+
+        # order offers by demand, away period, vehicle index and A before B
+        d, a, v = (numpy.concatenate(k) for k in zip(*keys))
+        order = numpy.lexsort((v, a, d))
+        offers = numpy.concatenate(offers, axis=1)[:, order].T.tolist()
+        nmbOffers = numpy.bincount(d, minlength=nmbDemands).tolist()
+        demandCreationDate = demandCreationDate.tolist()
+
+        lines = []
+        first = 0
+        for i in range(nmbDemands):
+            last = first + nmbOffers[i]
+            lines.append(" ".join(map(str, [demandCreationDate[i], nmbOffers[i]] + [e for o in offers[first:last] for e in o])) + "\n")
+            first = last
+        return lines
+
+    def createRandomOfferArrays(self, demandCreationDate, baseStartDate, baseDuration, dueDateRangeMax, shape):
+        """ Vectorized createRandomOffer, returns an array of cost (not yet set), twStart, twEnd and dueDate """
+        twStart = numpy.maximum(baseStartDate - self.extraDurationRange.getArray(self.rng, shape), demandCreationDate)
+        dueDate = numpy.maximum(twStart - RandomRange(0, dueDateRangeMax).getArray(self.rng, shape), demandCreationDate)
+        twEnd = baseStartDate + baseDuration + self.extraDurationRange.getArray(self.rng, shape)
+        return numpy.stack([numpy.zeros(shape, dtype=twStart.dtype), twStart, twEnd, dueDate])
 
     def createRandomDemand(self):
         """ Yields one mobility demand including its mobility offers as
@@ -120,8 +246,7 @@ class Generator():
         yield str(demandCreationDate)
         yield str(len(offers))
         for o in offers:
-            for e in o.getElements():
-                yield str(int(e))
+            yield o.toString()
 
     def createRandomOffersForADemand(self, demandCreationDate, baseStartDate, baseDuration, baseCostFactor):
         """ Yields offers for given base start dates and durations """
@@ -137,21 +262,21 @@ class Generator():
             if (vehicleTypeIndex != minVehicleTypeIndex):
                 usageProbability = self.vehicleUsageProbabilityOfNonPreferredVehicleType
 
-            for o.vehicleIndex in vehicleType.getVehicleIndices():
+            for vehicleIndex in vehicleType.getVehicleIndices():
                 if (self.probabilityRange.get() <= usageProbability):
-                    yield copy.deepcopy(o)
+                    yield o.withVehicleIndex(vehicleIndex)
 
         costFactorOfMinVehicleType = self.vehicleTypes[minVehicleTypeIndex].costFactor
 
         if (self.probabilityRange.get() <= self.probabilityNonVehicleA):
             o = self.createRandomOffer(demandCreationDate, baseStartDate, baseDuration, self.twDueDateRangeMaxNonVehicleA)
             o.cost = o.getDuration() * costFactorOfMinVehicleType * baseCostFactor * self.relativeCostOfNonVehicleA.get() / 100
-            yield copy.deepcopy(o)
+            yield o
 
         if (self.probabilityRange.get() <= self.probabilityNonVehicleB):
             o = self.createRandomOffer(demandCreationDate, baseStartDate, baseDuration, self.twDueDateRangeMaxNonVehicleB)
             o.cost = o.getDuration() * costFactorOfMinVehicleType * baseCostFactor * self.relativeCostOfNonVehicleB.get() / 100
-            yield copy.deepcopy(o)
+            yield o
 
     def createRandomOffer(self, demandCreationDate, baseStartDate, baseDuration, dueDateRangeMax):
         o = Offer()
@@ -191,20 +316,21 @@ class VehicleType():
 
 class Offer:
     """ Specifies a mobility offer """
-    def __init__(self):
-        self.cost = 0
-        self.twStart = 0
-        self.twEnd = 0
-        self.dueDate = 0
-        self.vehicleIndex = -1
+    __slots__ = ("cost", "twStart", "twEnd", "dueDate", "vehicleIndex")
+    def __init__(self, cost = 0, twStart = 0, twEnd = 0, dueDate = 0, vehicleIndex = -1):
+        self.cost = cost
+        self.twStart = twStart
+        self.twEnd = twEnd
+        self.dueDate = dueDate
+        self.vehicleIndex = vehicleIndex
     def getDuration(self):
         return self.twEnd - self.twStart
-    def getElements(self):
-        yield self.cost
-        yield self.twStart
-        yield self.twEnd
-        yield self.dueDate
-        yield self.vehicleIndex
+    def withVehicleIndex(self, vehicleIndex):
+        """ Returns a copy of this offer for the given vehicle """
+        return Offer(self.cost, self.twStart, self.twEnd, self.dueDate, vehicleIndex)
+    def toString(self):
+        """ Returns the elements of this offer as integers separated by spaces """
+        return "%d %d %d %d %d" % (self.cost, self.twStart, self.twEnd, self.dueDate, self.vehicleIndex)
 
 class RandomRange:
     """ Defines a range of integers in order to generate uniformly distributed random integers within that range (inclusive) """
@@ -217,6 +343,9 @@ class RandomRange:
         return "U[" + str(self.min) + "," + str(self.max) + "]"
     def get(self):
         return randint(self.min, self.max)
+    def getArray(self, rng, size):
+        """ Returns an array of the given size of random integers drawn with the numpy generator rng """
+        return rng.integers(self.min, self.max + 1, size)
 
 class UniqueRandomRange:
     """ RandomRange where no number is drawn twice """
@@ -238,13 +367,33 @@ class UniqueRandomRange:
             return self.get()
         self.usedNumbers.add(result)
         return result
+    def getUniqueArray(self, rng, size, nmbNumbers):
+        """ Returns a (size x nmbNumbers) array where each row contains nmbNumbers distinct random numbers
+            in drawing order, drawn with the numpy generator rng
+        """
+        if nmbNumbers > self.size():
+            raise AttributeError("Cannot draw " + str(nmbNumbers) + " unused numbers from unique random range [" + str(self.min) + ", " + str(self.max) + "].")
+        result = numpy.empty((size, nmbNumbers), dtype=numpy.int64)
+        for j in range(nmbNumbers):
+            r = rng.integers(self.min, self.max + 1 - j, size)
+            # skip the numbers already used in a row, in ascending order
+            for used in numpy.sort(result[:, :j], axis=1).T:
+                r += r >= used
+            result[:, j] = r
+        return result
 
 class GeneratorException (BaseException):
     """ An exception that can be thrown by the instance generator """
     pass
 
-try:
-    run()
-except GeneratorException as e:
-    print ("\nError: " + str(e) + "\n")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generates the instances of the parameter grid")
+    parser.add_argument("--processes", type=int, default=1, help="number of worker processes (0: all cores, default: 1)")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the first parameter combination")
+    parser.add_argument("--scalar", action="store_true", help="draw random numbers one by one instead of vectorized")
+    args = parser.parse_args()
+    try:
+        run(processes=args.processes or None, seed=args.seed, vectorized=not args.scalar)
+    except GeneratorException as e:
+        print ("\nError: " + str(e) + "\n")
 
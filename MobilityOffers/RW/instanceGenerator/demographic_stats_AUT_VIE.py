@@ -1,9 +1,10 @@
 from numpy.random import choice
-from random import choice as rchoice
 from enum import Enum
 import attr
+import numpy as np
 
 from mot import MoT
+from sampling import AliasSampler, Sampler
 
 ONEHOUR = 60
 TT_BUFFER_MIN = 60  #  1 hour travel time buffer within vienna
@@ -128,22 +129,24 @@ p_home = [0.002179424, 0.000841881, 0.001131726, 0.000816353, 0.001149809, 0.001
           0.002195379, 0.002629349, 0.001238624, 0.001699717, 0.000154761, 0.002837294, 0.00510181]
 
 
+home_sampler = Sampler(registration_districts, p_home)
+office_sampler = Sampler(registration_districts, p_office)
+
+
 def home_location(exclude=[]):
-    while True:
-        l = int(choice(registration_districts, p=p_home))
-        if l in exclude:
-            False
-        else:
-            return l
+    return int(home_sampler.excluding(exclude).draw())
+
+
+def home_locations(n, exclude=[]):
+    return home_sampler.excluding(exclude).draw(n)
 
 
 def office_location(exclude=[]):
-    while True:
-        l = int(choice(registration_districts, p=p_office))
-        if l in exclude:
-            False
-        else:
-            return l
+    return int(office_sampler.excluding(exclude).draw())
+
+
+def office_locations(n, exclude=[]):
+    return office_sampler.excluding(exclude).draw(n)
 
 
 class EmployeeType(Enum):
@@ -157,8 +160,8 @@ class Gender(Enum):
     female = 0.4678
 
     @classmethod
-    def pick(cls):
-        return choice([cls.female, cls.male], p=[cls.female.value, cls.male.value])
+    def pick(cls, size=None):
+        return gender_sampler.draw(size)
 
     @classmethod
     def valid(cls, g):
@@ -168,66 +171,118 @@ class Gender(Enum):
         return self.name == "female"
 
 
+gender_sampler = Sampler([Gender.female, Gender.male], [Gender.female.value, Gender.male.value])
+
+
 def pick_gender():
     return Gender.pick()
 
 
-def pick_age(gender):
-    Gender.valid(gender)
+def pick_genders(n):
+    return Gender.pick(n)
 
-    age = [15, 20, 25, 30, 35, 40, 45, 50, 55, 60]
-    if gender == "f":
-        p_age = [0.03, 0.09, 0.12, 0.12, 0.11, 0.13, 0.15, 0.15, 0.09, 0.01]
-    else:
-        p_age = [0.04, 0.09, 0.11, 0.12, 0.12, 0.12, 0.13, 0.13, 0.1, 0.04]
 
-    assert len(age) == len(p_age)
-    assert sum(p_age) == 1
+age = [15, 20, 25, 30, 35, 40, 45, 50, 55, 60]
+p_age_female = [0.03, 0.09, 0.12, 0.12, 0.11, 0.13, 0.15, 0.15, 0.09, 0.01]
+p_age_male = [0.04, 0.09, 0.11, 0.12, 0.12, 0.12, 0.13, 0.13, 0.1, 0.04]
+assert len(age) == len(p_age_female) == len(p_age_male)
+assert sum(p_age_female) == 1
+assert sum(p_age_male) == 1
+age_samplers = {"f": Sampler(age, p_age_female), "m": Sampler(age, p_age_male)}
 
-    return int(choice(age, p=p_age))
+week_minutes_hist = [10 * ONEHOUR, 20 * ONEHOUR, 30 * ONEHOUR, 40 * ONEHOUR, 50 * ONEHOUR, 60 * ONEHOUR]  # creatively rounded wrt Statistik Austria
+p_minutes_female = [0.09, 0.19, 0.23, 0.36, 0.11, 0.02]
+p_minutes_male = [0.04, 0.04, 0.05, 0.54, 0.26, 0.07]
+assert len(week_minutes_hist) == len(p_minutes_female) == len(p_minutes_male)
+assert sum(p_minutes_female) == 1
+assert sum(p_minutes_male) == 1
+minutes_samplers = {"f": Sampler(week_minutes_hist, p_minutes_female), "m": Sampler(week_minutes_hist, p_minutes_male)}
 
+day_hist = list(range(1, 8))
+p_working_days = [0.015, 0.027, 0.044, 0.055, 0.734, 0.101, 0.024]
+assert len(day_hist) == len(p_working_days)
+assert sum(p_working_days) == 1
+working_days_sampler = Sampler(day_hist, p_working_days)
 
-def weekly_minutes_and_days_per_week(gender, e_type, boss_work_hours=40, boss_workdays=4):
+
+def _sampler_key(gender):
+    # note: compares the Gender to "f", so the distributions for men are used for all employees
+    return "f" if gender == "f" else "m"
+
+
+def _draw_by_gender(samplers, genders):
+    """ draws one value per gender, all values of the same distribution at once """
+    keys = np.array([_sampler_key(g) for g in genders])
+    values = np.zeros(len(genders), dtype=int)
+    for key, sampler in samplers.items():
+        mask = keys == key
+        if mask.any():
+            values[mask] = sampler.draw(int(mask.sum()))
+    return values
+
+
+def pick_age(gender):
     Gender.valid(gender)
 
-    week_minutes_hist = [10 * ONEHOUR, 20 * ONEHOUR, 30 * ONEHOUR, 40 * ONEHOUR, 50 * ONEHOUR, 60 * ONEHOUR]  # creatively rounded wrt Statistik Austria
+    return int(age_samplers[_sampler_key(gender)].draw())
+
 
-    if gender == "f":
-        p_minutes = [0.09, 0.19, 0.23, 0.36, 0.11, 0.02]
-    else:
-        p_minutes = [0.04, 0.04, 0.05, 0.54, 0.26, 0.07]
+def pick_ages(genders):
+    for g in genders:
+        Gender.valid(g)
 
-    day_hist = list(range(1, 8))
-    p_working_days = [0.015, 0.027, 0.044, 0.055, 0.734, 0.101, 0.024]
+    return _draw_by_gender(age_samplers, genders)
+
+
+def is_valid_working_time(weekly_minutes, days_per_week, e_type, boss_work_hours=40, boss_workdays=4):
+    """
+    works for single values as well as for arrays of weekly minutes and days per week
+    """
+    is_boss = e_type == EmployeeType.boss
+    invalid = np.logical_and(is_boss, np.asarray(weekly_minutes)/ONEHOUR < boss_work_hours)  # bosses work a lot
+    invalid |= np.logical_and(is_boss, np.asarray(days_per_week) < boss_workdays)
+    for minutes, days in [(1200, 2), (1800, 3), (2400, 4), (3000, 5), (3600, 6)]:
+        invalid |= np.logical_and(np.asarray(weekly_minutes) >= minutes, np.asarray(days_per_week) < days)
+    return ~invalid
 
-    assert len(week_minutes_hist) == len(p_minutes)
-    assert len(day_hist) == len(p_working_days)
-    assert sum(p_minutes) == 1
-    assert sum(p_working_days) == 1
+
+def weekly_minutes_and_days_per_week(gender, e_type, boss_work_hours=40, boss_workdays=4):
+    Gender.valid(gender)
 
     while True:
-        weekly_minutes = int(choice(week_minutes_hist, p=p_minutes))
-        days_per_week = int(choice(day_hist, p=p_working_days))
+        weekly_minutes = int(minutes_samplers[_sampler_key(gender)].draw())
+        days_per_week = int(working_days_sampler.draw())
 
         weekly_minutes = (weekly_minutes/days_per_week)//60*60*days_per_week  # to get full hours per day, not 8h20min
 
-        if e_type == EmployeeType.boss and weekly_minutes/ONEHOUR < boss_work_hours:  # bosses work a lot
-            False
-        elif e_type == EmployeeType.boss and days_per_week < boss_workdays:
-            False
-        elif weekly_minutes >= 1200 and days_per_week < 2:
-            False
-        elif weekly_minutes >= 1800 and days_per_week < 3:
-            False
-        elif weekly_minutes >= 2400 and days_per_week < 4:
-            False
-        elif weekly_minutes >= 3000 and days_per_week < 5:
-            False
-        elif weekly_minutes >= 3600 and days_per_week < 6:
-            False
-        else:
+        if is_valid_working_time(weekly_minutes, days_per_week, e_type, boss_work_hours, boss_workdays):
             return weekly_minutes, days_per_week
-            break
+
+
+def pick_weekly_minutes_and_days(genders, e_type, boss_work_hours=40, boss_workdays=4):
+    """
+    weekly_minutes_and_days_per_week for all genders at once, rejected draws are redrawn together
+    """
+    for g in genders:
+        Gender.valid(g)
+
+    genders = np.asarray(genders, dtype=object)
+    weekly_minutes = np.zeros(len(genders))
+    days_per_week = np.zeros(len(genders), dtype=int)
+
+    pending = np.arange(len(genders))
+    while len(pending) > 0:
+        minutes = _draw_by_gender(minutes_samplers, genders[pending])
+        days = working_days_sampler.draw(len(pending))
+
+        minutes = (minutes/days)//60*60*days  # to get full hours per day, not 8h20min
+
+        valid = is_valid_working_time(minutes, days, e_type, boss_work_hours, boss_workdays)
+        weekly_minutes[pending[valid]] = minutes[valid]
+        days_per_week[pending[valid]] = days[valid]
+        pending = pending[~valid]
+
+    return weekly_minutes, days_per_week
 
 
 begin = [5 * ONEHOUR, 6 * ONEHOUR, 7 * ONEHOUR, 8 * ONEHOUR, 510, 9 * ONEHOUR, 570, 10 * ONEHOUR, 630, 11 * ONEHOUR]
@@ -236,8 +291,15 @@ assert len(begin) == len(p_begin)
 assert sum(p_begin) == 1
 
 
+begin_sampler = Sampler(begin, p_begin)
+
+
 def work_begin():
-    return int(choice(begin, p=p_begin))
+    return int(begin_sampler.draw())
+
+
+def work_begins(n):
+    return begin_sampler.draw(n)
 
 
 meetings = list(range(0, 11))
@@ -249,8 +311,11 @@ assert len(meeting_duration) == len(p_meeting_dur)
 assert sum(p_meeting_dur) == 1
 
 
+meeting_duration_sampler = Sampler(meeting_duration, p_meeting_dur)
+
+
 def pick_meeting_duration():
-    return int(choice(meeting_duration, p=p_meeting_dur))
+    return int(meeting_duration_sampler.draw())
 
 
 def fits_inside(minutes_a, work_before_meet, minutes_b):
@@ -263,10 +328,15 @@ def reasonable_daytime(begin, DUSK=5, DAWN=22):
     return minutes >= DUSK * ONEHOUR and minutes <= DAWN * ONEHOUR
 
 
+license_sampler = Sampler([False, True], [0.13, 0.87])
+
+
 def has_license():
-    license = [False, True]
-    p_license = [0.13, 0.87]
-    return bool(choice(license, p=p_license))
+    return bool(license_sampler.draw())
+
+
+private_meeting_morning_sampler = Sampler([True, False], [0.2, 0.8])
+private_meeting_evening_sampler = Sampler([True, False], [0.65, 0.35])
 
 
 def private_meeting_morning():
@@ -276,11 +346,12 @@ def private_meeting_morning():
     Hence for now pre-work private meetings are generated with a 20% chance,
      and after-work meetings with a 2/3 chance.
     """
-    return bool(choice([True, False], p=[0.2, 0.8]))
+    return bool(private_meeting_morning_sampler.draw())
 
 
 def private_meeting_evening():
-    return bool(choice([True, False], p=[0.65, 0.35]))
+    return bool(private_meeting_evening_sampler.draw())
+
 
 
 @attr.s
@@ -331,27 +402,44 @@ assert sum(_p_female) == 1
 assert sum(_p_male) == 1
 
 
+# each model with its variants, which are equally likely
+_models = [
+    ("generic", [[True, True, True, True], [False, True, True, True], [True, False, True, True]]),
+    ("motorised_only", [[True, True, True, False], [True, False, True, False], [False, True, True, False]]),
+    ("no_pt", [[True, True, False, True], [True, False, False, True], [False, True, False, True]]),
+    ("no_motorised", [[False, False, True, True]]),
+    ("cars_only", [[True, True, False, False], [True, False, False, False], [False, True, False, False]]),
+    ("pt_only", [[False, False, True, False]]),
+    ("bike_only", [[False, False, False, True]])]
+_models_without_license = [
+    ("no_motorised", [[False, False, True, True]]),
+    ("pt_only", [[False, False, True, False]]),
+    ("bike_only", [[False, False, False, True]])]
+_p_without_license = [0.33, 0.33, 0.34]
+
+
+def _model_sampler(models, p_mt):
+    """ an alias sampler of all (modelname, model) variants, the probability of a model is split among its variants """
+    variants = [(name, model) for name, variants in models for model in variants]
+    p = [p_model / len(variants) for (name, variants), p_model in zip(models, p_mt) for model in variants]
+    return AliasSampler(variants, p)
+
+
+# by (has license, is female)
+model_samplers = {(True, True): _model_sampler(_models, _p_female),
+                  (True, False): _model_sampler(_models, _p_male),
+                  (False, True): _model_sampler(_models_without_license, _p_without_license),
+                  (False, False): _model_sampler(_models_without_license, _p_without_license)}
+
+
 class MOTPreferencesVienna(object):
-    def __init__(self, gender):
-        self.has_lic = has_license()
-
-        models = [
-            ("generic", rchoice([[True, True, True, True],[False, True, True, True], [True, False, True, True]])),
-            ("motorised_only", rchoice([[True, True, True, False], [True, False, True, False], [False, True, True, False]])),
-            ("no_pt", rchoice([[True, True, False, True], [True, False, False, True], [False, True, False, True]])),
-            ("no_motorised", [False, False, True, True]),
-            ("cars_only", rchoice([[True, True, False, False], [True, False, False, False], [False, True, False, False]])),
-            ("pt_only", [False, False, True, False]),
-            ("bike_only", [False, False, False, True])]
-        p_mt = _p_female if gender.is_female() else _p_male
-
-        if not self.has_lic:
-            models = [("no_motorised", [False, False, True, True]),
-                      ("pt_only", [False, False, True, False]),
-                      ("bike_only", [False, False, False, True])]
-            p_mt = [0.33, 0.33, 0.34]
-
-        modelname, model = models[choice(list(range(len(models))), p=p_mt)]
+    def __init__(self, gender, has_lic=None, model=None):
+        """ has_lic and the (modelname, model) variant are drawn unless given """
+        self.has_lic = has_license() if has_lic is None else has_lic
+
+        if model is None:
+            model = model_samplers[(self.has_lic, gender.is_female())].draw()
+        modelname, model = model
 
         self.pref_car = model[0]
         self.pref_ecar = model[1]
@@ -360,10 +448,31 @@ class MOTPreferencesVienna(object):
         self.pref_type = modelname
 
 
+def _to_mot_preferences(m):
+    return MOTPreferences(desc="Vienna Mobility Type " + m.pref_type, has_license=m.has_lic, car=m.pref_car, ecar=m.pref_ecar, pt=m.pref_pt, bike=m.pref_bike)
+
+
 def create_mot_preferences_vienna(gender):
-    m = MOTPreferencesVienna(gender)
+    return _to_mot_preferences(MOTPreferencesVienna(gender))
 
-    return MOTPreferences(desc="Vienna Mobility Type " + m.pref_type, has_license=m.has_lic, car=m.pref_car, ecar=m.pref_ecar, pt=m.pref_pt, bike=m.pref_bike)
+
+def create_mot_preferences_vienna_for(genders):
+    """
+    create_mot_preferences_vienna for all genders at once, the licenses and the models of each group
+    of equal license and gender are drawn in one go
+    """
+    has_lic = license_sampler.draw(len(genders)).tolist()
+    keys = [(h, g.is_female()) for h, g in zip(has_lic, genders)]
+
+    rows = dict()
+    for i, key in enumerate(keys):
+        rows.setdefault(key, []).append(i)
+    models = [None] * len(genders)
+    for key, r in rows.items():
+        for i, model in zip(r, model_samplers[key].draw(len(r))):
+            models[i] = model
+
+    return [_to_mot_preferences(MOTPreferencesVienna(g, h, m)) for g, h, m in zip(genders, has_lic, models)]
 
 
 def create_mot_preferences_simple():
@@ -1,11 +1,20 @@
 from mot import MoT, costPerUnitOfEmission
 import csv
+import hashlib
+import os
+import numpy as np
+from operator import attrgetter
 from geopy import distance, Point
-distance.VincentyDistance.ELLIPSOID = 'WGS-84'
 
+ELLIPSOID = 'WGS-84'
 
-def _load_nodes():
-    with open("doc/zaehlbezirke.csv") as zb:
+NODE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "doc", "zaehlbezirke.csv")
+CACHE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+CACHE_VERSION = 1  # increase whenever the computation of the cached matrix changes
+
+
+def _load_nodes(node_file=NODE_FILE):
+    with open(node_file) as zb:
         nodes = dict()
         reader = csv.DictReader(zb)
         for row in reader:
@@ -14,6 +23,82 @@ def _load_nodes():
         return nodes
 
 
+def aerial_distance_matrix(lat, lon, ellipsoid=ELLIPSOID, max_iterations=200, tolerance=1e-12):
+    """
+    computes the (nodes x nodes) matrix of ellipsoidal distances in meters between all given coordinates
+    in one batched pass of Vincenty's inverse formula
+    """
+    a, b, f = distance.ELLIPSOIDS[ellipsoid]
+    a, b = a * 1000, b * 1000
+
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lon = np.radians(np.asarray(lon, dtype=float))
+
+    U = np.arctan((1 - f) * np.tan(lat))
+    sinU1, sinU2 = np.sin(U)[:, None], np.sin(U)[None, :]
+    cosU1, cosU2 = np.cos(U)[:, None], np.cos(U)[None, :]
+    L = lon[None, :] - lon[:, None]
+
+    lam = L
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(max_iterations):
+            sinLam, cosLam = np.sin(lam), np.cos(lam)
+            sinSigma = np.sqrt((cosU2 * sinLam) ** 2 + (cosU1 * sinU2 - sinU1 * cosU2 * cosLam) ** 2)
+            cosSigma = sinU1 * sinU2 + cosU1 * cosU2 * cosLam
+            sigma = np.arctan2(sinSigma, cosSigma)
+            sinAlpha = np.where(sinSigma == 0, 0.0, cosU1 * cosU2 * sinLam / sinSigma)
+            cosSqAlpha = 1 - sinAlpha ** 2
+            cos2SigmaM = np.where(cosSqAlpha == 0, 0.0, cosSigma - 2 * sinU1 * sinU2 / cosSqAlpha)
+            C = f / 16 * cosSqAlpha * (4 + f * (4 - 3 * cosSqAlpha))
+
+            lam_prev = lam
+            lam = L + (1 - C) * f * sinAlpha * (
+                sigma + C * sinSigma * (cos2SigmaM + C * cosSigma * (-1 + 2 * cos2SigmaM ** 2)))
+            if np.all(np.abs(lam - lam_prev) <= tolerance):
+                break
+        else:
+            raise ValueError("Vincenty formula failed to converge")
+
+    uSq = cosSqAlpha * (a ** 2 - b ** 2) / (b ** 2)
+    A = 1 + uSq / 16384 * (4096 + uSq * (-768 + uSq * (320 - 175 * uSq)))
+    B = uSq / 1024 * (256 + uSq * (-128 + uSq * (74 - 47 * uSq)))
+    deltaSigma = B * sinSigma * (cos2SigmaM + B / 4 * (cosSigma * (-1 + 2 * cos2SigmaM ** 2) -
+                                                       B / 6 * cos2SigmaM * (-3 + 4 * sinSigma ** 2) *
+                                                       (-3 + 4 * cos2SigmaM ** 2)))
+    return np.where(sinSigma == 0, 0.0, b * A * (sigma - deltaSigma))
+
+
+def _cache_file(node_file, ellipsoid, cache_dir):
+    h = hashlib.sha1()
+    with open(node_file, "rb") as f:
+        h.update(f.read())
+    h.update("{:} {:}".format(ellipsoid, CACHE_VERSION).encode())
+    return os.path.join(cache_dir, "aerial_{:}.npy".format(h.hexdigest()))
+
+
+def load_aerial_distance_matrix(nodes, node_file=NODE_FILE, ellipsoid=ELLIPSOID, cache_dir=CACHE_DIRECTORY):
+    """
+    returns the aerial distance matrix of the given nodes, memory-mapped from the cache if the node file
+    and the ellipsoid did not change since it was computed, otherwise it is computed and cached
+    """
+    filename = _cache_file(node_file, ellipsoid, cache_dir)
+    if os.path.exists(filename):
+        aerial = np.load(filename, mmap_mode="r")
+        if aerial.shape == (len(nodes), len(nodes)):
+            return aerial
+
+    aerial = aerial_distance_matrix([n.lat() for n in nodes], [n.lon() for n in nodes], ellipsoid=ellipsoid)
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    # write to a temporary file first so concurrent runs never read a partially written matrix
+    tmp = "{:}.{:}.tmp".format(filename, os.getpid())
+    with open(tmp, "wb") as f:
+        np.save(f, aerial)
+    os.replace(tmp, filename)
+    return aerial
+
+
 class Node(object):
     def __init__(self, id, lat, lon):
         self.id = id
@@ -25,9 +110,6 @@ class Node(object):
     def lat(self):
         return self.pos.latitude
 
-    def aerial_distance_to(self, other):
-        return distance.distance(self.pos, other.pos).meters
-
 
 class MoveOption (object):
     def __init__(self, fn, tn, mot):
@@ -45,33 +127,87 @@ class MoveOption (object):
 
 
 class DistanceMatrix(object):
-    def __init__(self):
-        self.nodes = _load_nodes()
-
-        self.move_options = []
+    """
+    dense (nodes x nodes x mots) distance, duration and cost tensors.
+    nodes are indexed in the order of the node file (see node_index), mots by their id.
+    """
+    def __init__(self, node_file=NODE_FILE, use_cache=True):
+        self.node_file = node_file
+        self.use_cache = use_cache
+        self.nodes = _load_nodes(node_file)
+        self.node_ids = np.array(list(self.nodes.keys()))
+        self.node_index = {nid: i for i, nid in enumerate(self.nodes.keys())}
+
+        self.mots = sorted(MoT.manager.to_list(), key=attrgetter("id"))
+        assert [m.id for m in self.mots] == list(range(len(self.mots)))
+
+        self.aerial_distance = None
+        self.distance_meters = None
+        self.duration_seconds = None
+        self.cost = None
+        self._move_options = None
         self.generate_matrix()
 
-    def generate_matrix(self):
-        for fromNode in self.nodes.values():
-            for toNode in self.nodes.values():
-                aerial = fromNode.aerial_distance_to(toNode)
+    def _mot_vector(self, attribute):
+        return np.array([getattr(m, attribute) for m in self.mots], dtype=float)
 
-                for mot in MoT.manager.to_list():
-                    option = MoveOption(fn=fromNode.id, tn=toNode.id, mot=mot.id)
-                    option.geom = "LINESTRING({:} {:}, {:} {:})".format(fromNode.lon(), fromNode.lat(), toNode.lon(),
-                                                                 toNode.lat())
-                    option.aerial_distance = aerial
-
-                    sloped_dist = aerial * mot.slopingFactor
-                    emissions = sloped_dist * mot.emissionsPerDistance
-
-                    option.distance_meters = sloped_dist
-                    option.duration_seconds = sloped_dist * mot.durationPerDistance + mot.overheadDuration
-                    option.cost = sloped_dist * mot.costPerDistance + option.duration_seconds * mot.costPerTime + emissions * costPerUnitOfEmission
-
-                    self.move_options.append(option)
+    def generate_matrix(self):
+        nodes = list(self.nodes.values())
+        if self.use_cache:
+            self.aerial_distance = load_aerial_distance_matrix(nodes, node_file=self.node_file)
+        else:
+            self.aerial_distance = aerial_distance_matrix([n.lat() for n in nodes], [n.lon() for n in nodes])
+
+        sloped_dist = self.aerial_distance[:, :, None] * self._mot_vector("slopingFactor")
+        emissions = sloped_dist * self._mot_vector("emissionsPerDistance")
+
+        self.distance_meters = sloped_dist
+        self.duration_seconds = sloped_dist * self._mot_vector("durationPerDistance") + self._mot_vector("overheadDuration")
+        self.cost = sloped_dist * self._mot_vector("costPerDistance") + \
+            self.duration_seconds * self._mot_vector("costPerTime") + emissions * costPerUnitOfEmission
+
+    def move_option(self, fn, tn, mot):
+        """ creates the MoveOption from node id fn to node id tn with the mot of id mot """
+        fromNode, toNode = self.nodes[fn], self.nodes[tn]
+        i, j = self.node_index[fn], self.node_index[tn]
+
+        option = MoveOption(fn=fn, tn=tn, mot=mot)
+        option.geom = "LINESTRING({:} {:}, {:} {:})".format(fromNode.lon(), fromNode.lat(), toNode.lon(), toNode.lat())
+        option.aerial_distance = float(self.aerial_distance[i, j])
+        option.distance_meters = float(self.distance_meters[i, j, mot])
+        option.duration_seconds = float(self.duration_seconds[i, j, mot])
+        option.cost = float(self.cost[i, j, mot])
+        return option
+
+    @property
+    def move_options(self):
+        """ MoveOption objects for all node pairs and mots, only materialized on first access """
+        if self._move_options is None:
+            self._move_options = [self.move_option(fn, tn, mot.id)
+                                  for fn in self.nodes for tn in self.nodes for mot in self.mots]
+        return self._move_options
 
     def get_node(self, nid):
         assert nid in self.nodes.keys()
 
         return self.nodes.get(nid)
+
+
+class LazyMoveOptions(object):
+    """
+    (from node id, to node id, mot id) -> MoveOption lookup that creates each MoveOption on first request
+    and memoizes it, so only the triples that are actually used are ever materialized
+    """
+    def __init__(self, matrix):
+        self.matrix = matrix
+        self.options = dict()
+
+    def get(self, fn, tn, mot):
+        key = (fn, tn, mot)
+        option = self.options.get(key)
+        if option is None:
+            option = self.options[key] = self.matrix.move_option(fn, tn, mot)
+        return option
+
+    def __len__(self):
+        return len(self.options)
@@ -1,13 +1,20 @@
 import demographic_stats_AUT_VIE as ds
 from i_utils import to_date
+from instrumentation import phase, record
 
 from itertools import count
 
 from enum import Enum
 import logging
-from numpy.random import choice, normal
+from numpy.random import choice, normal, randint
+import numpy as np
 from numpy import ceil
-from operator import attrgetter
+from bisect import bisect_left, bisect_right
+from heapq import heappop, heappush
+
+
+MORNING_ACTIVITY_MINUTES = 60  # duration of private activities before work
+EVENING_ACTIVITY_MINUTES = 120  # duration of private activities after work
 
 
 class ActivityType(Enum):
@@ -17,6 +24,9 @@ class ActivityType(Enum):
     private = "Private"
 
 
+ACTIVITY_TYPES = list(ActivityType)
+
+
 class Timeperiod(object):
     def __init__(self, begin, end, loc, activity):
         self.begin = begin
@@ -37,47 +47,180 @@ class Timeperiod(object):
         return "{:}-{:} {:} loc {:}".format(to_date(self.begin), to_date(self.end), self.activity.name, self.loc)
 
 
-class Schedule(object):
+class SortedTimeperiods(object):
+    """
+    timeperiods ordered by begin, timeperiods with equal begin in the order they were added
+    """
     def __init__(self):
+        self.begins = []
         self.items = []
 
     def add(self, act):
-        temp = self.items.copy()
-        temp.append(act)
-        self.items = sorted(temp, key=attrgetter("begin"))
+        i = bisect_right(self.begins, act.begin)
+        self.begins.insert(i, act.begin)
+        self.items.insert(i, act)
+
+    def append(self, act):
+        """ adds a timeperiod which does not begin before any timeperiod added so far """
+        assert not self.begins or self.begins[-1] <= act.begin
+        self.begins.append(act.begin)
+        self.items.append(act)
 
     def remove(self, act):
-        self.items.remove(act)
+        # only the timeperiods with the same begin need to be searched for act
+        for i in range(bisect_left(self.begins, act.begin), bisect_right(self.begins, act.begin)):
+            if self.items[i] is act:
+                del self.begins[i]
+                del self.items[i]
+                return
+        raise ValueError("{:} not in schedule".format(act))
+
+
+class Schedule(object):
+    """
+    the timeperiods of an employee ordered by begin, with an index per activity type which is kept up to date incrementally.
+    a schedule can be created from rows of (begin, end, loc, activity) ordered by begin,
+    their Timeperiod objects are only created when the schedule is accessed for the first time.
+    """
+    def __init__(self, rows=None):
+        self.rows = rows
+        self._all = None
+        self._by_type = None
+
+    def _materialize(self):
+        if self._all is None:
+            self._all = SortedTimeperiods()
+            self._by_type = {t: SortedTimeperiods() for t in ACTIVITY_TYPES}
+            if self.rows is not None:
+                rows, self.rows = self.rows, None
+                for row in rows.tolist() if isinstance(rows, np.ndarray) else rows:
+                    act = Timeperiod(*row)
+                    self._all.append(act)
+                    self._by_type[act.activity].append(act)
+
+    @property
+    def all(self):
+        self._materialize()
+        return self._all
+
+    @property
+    def by_type(self):
+        self._materialize()
+        return self._by_type
+
+    @property
+    def items(self):
+        return self.all.items
+
+    def add(self, act):
+        self.all.add(act)
+        self.by_type[act.activity].add(act)
+
+    def remove(self, act):
+        self.all.remove(act)
+        self.by_type[act.activity].remove(act)
 
     def get_all(self, type):
-        return [x for x in self.items if x.activity is type]
+        return self.by_type[type].items.copy()
 
     def get(self):
-        return self.items.copy()
+        return self.all.items.copy()
+
+
+def build_schedules(employees, private_activities=True):
+    """
+    builds the schedules of all employees in one vectorized pass over all their working days:
+    a work timeperiod and the following home timeperiod per working day, see Employee.
+    with private_activities, a private activity of MORNING_ACTIVITY_MINUTES is split off the end of a home timeperiod
+    with the probability of ds.private_meeting_morning and one of EVENING_ACTIVITY_MINUTES off its beginning with the
+    probability of ds.private_meeting_evening, each at a home location other than the employee's home and office and
+    separated from the remaining home timeperiod by ds.TT_BUFFER_MIN. the activities of all home timeperiods are drawn at once.
+    returns one Schedule per employee, which only creates its Timeperiod objects when accessed.
+    """
+    working_days = np.array([e.working_days for e in employees], dtype=int)
+    emp = np.repeat(np.arange(len(employees)), working_days)
+    day = np.arange(len(emp)) - np.repeat(np.cumsum(working_days) - working_days, working_days)
+    begin = np.array([e.begin for e in employees], dtype=int)[emp]
+    daily_minutes = np.array([e.daily_minutes for e in employees], dtype=float)[emp]
+    home = np.array([e.home for e in employees], dtype=int)[emp]
+    office = np.array([e.office for e in employees], dtype=int)[emp]
+
+    work_begin = begin + day * 1440
+    work_end = work_begin + daily_minutes
+    home_begin = work_end + ds.TT_BUFFER_MIN
+    home_end = begin + (day + 1) * 1440 - ds.TT_BUFFER_MIN
+
+    morning = np.zeros(len(emp), dtype=bool)
+    evening = np.zeros(len(emp), dtype=bool)
+    private_locs = [np.zeros(0, dtype=int), np.zeros(0, dtype=int)]
+
+    if private_activities:
+        excluded_locs = np.stack([home, office], axis=1)
+
+        morning = ds.private_meeting_morning_sampler.draw(len(emp)).astype(bool)
+        private_locs[0] = ds.home_sampler.draw_excluding(excluded_locs[morning])
+
+        evening = ds.private_meeting_evening_sampler.draw(len(emp)).astype(bool)
+        private_locs[1] = ds.home_sampler.draw_excluding(excluded_locs[evening])
+
+    morning_begin = home_end - MORNING_ACTIVITY_MINUTES
+    evening_end = home_begin + EVENING_ACTIVITY_MINUTES
+
+    # the timeperiods of each day are ordered work, evening private activity, home, morning private activity
+    nmb_rows = 2 + morning + evening
+    first = np.cumsum(nmb_rows) - nmb_rows
+    parts = [(first, work_begin, work_end, office, ActivityType.work),
+             ((first + 1)[evening], home_begin[evening], evening_end[evening], private_locs[1], ActivityType.private),
+             (first + 1 + evening, np.where(evening, evening_end + ds.TT_BUFFER_MIN, home_begin),
+              np.where(morning, morning_begin - ds.TT_BUFFER_MIN, home_end), home, ActivityType.home),
+             ((first + 2 + evening)[morning], morning_begin[morning], home_end[morning], private_locs[0], ActivityType.private)]
+
+    rows = np.empty((int(nmb_rows.sum()), 4), dtype=object)
+    for positions, begins, ends, locs, activity in parts:
+        # tolist keeps the python types, i.e. integral begins and ends stay ints
+        rows[positions, 0] = begins.tolist()
+        rows[positions, 1] = ends.tolist()
+        rows[positions, 2] = locs.tolist()
+        rows[positions, 3] = activity
+
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(emp, weights=nmb_rows, minlength=len(employees)))]).astype(int).tolist()
+    return [Schedule(rows[first:last]) for first, last in zip(bounds[:-1], bounds[1:])]
 
 
 class Fleet(object):
-    def __init__(self, number_employees, car_types, ecar_types):
+    def __init__(self, number_employees, car_types, ecar_types, attempts=64):
+        """
+        the number of bikes and of vehicles of each car and ecar type are drawn uniformly, conditioned on
+        sum_cars + sum_ecars <= number_employees.
+        if the constraint cannot be violated a single draw is used, otherwise attempts draws are made at once
+        and the first one satisfying the constraint is taken.
+        """
+        max_bikes = int(number_employees * 0.15)
+        max_cars = max(1, int(number_employees * 0.15))
+        types = car_types + ecar_types
+        rows = 1 if types * (max_cars - 1) <= number_employees else attempts
+
+        # one row per draw: the number of bikes, of each car type and of each ecar type
+        high = [max_bikes] + [max_cars] * types
         while True:
-            self.n_bikes = int(choice(list(range(0, int(number_employees * 0.15)))))
+            draws = randint(0, high, size=(rows, 1 + types))
+            valid = np.flatnonzero(draws[:, 1:].sum(axis=1) <= number_employees)
+            if len(valid) > 0:
+                break
+        draw = draws[valid[0]].tolist()
 
-            for i in range(car_types):
-                key = "car_{:}".format(i)
-                val = int(choice(list(range(0, max(1, int(number_employees * 0.15))))))
-                self.__dict__[key] = val
+        self.n_bikes = draw[0]
 
-            for i in range(ecar_types):
-                key = "ecar_{:}".format(i)
-                val = int(choice(list(range(0, max(1, int(number_employees * 0.15))))))
-                self.__dict__[key] = val
+        for i in range(car_types):
+            key = "car_{:}".format(i)
+            self.__dict__[key] = draw[1 + i]
 
-            self.sum_cars = self._sum("car_")
-            self.sum_ecars = self._sum("ecar_")
+        for i in range(ecar_types):
+            key = "ecar_{:}".format(i)
+            self.__dict__[key] = draw[1 + car_types + i]
 
-            if self.sum_cars + self.sum_ecars > number_employees:
-                False
-            else:
-                break
+        self.sum_cars = self._sum("car_")
+        self.sum_ecars = self._sum("ecar_")
 
     def _sum(self, prefix):
         sum = 0
@@ -96,6 +239,7 @@ class Company(object):
         self.fleet = fleet
 
         self.employees = list()
+        self.employees_by_id = dict()
         self.create_employees(nmbemp, boss_perc, middle_manag)
 
     def create_employees(self, number_employees, boss_perc, middle_manag):
@@ -103,7 +247,7 @@ class Company(object):
         middle = int(number_employees*middle_manag)
         workers = number_employees-bosses-middle
 
-        logging.info("creating {:} worker(s), {:} middle management and {:} boss(es)".format(workers, middle, bosses))
+        logging.info("creating %s worker(s), %s middle management and %s boss(es)", workers, middle, bosses)
 
         unique_id = count(start=1)
 
@@ -111,7 +255,13 @@ class Company(object):
         self._create(middle, ds.EmployeeType.middle_management, unique_id)
         self._create(workers, ds.EmployeeType.worker, unique_id)
 
-        self._create_external_meetings()
+        # work and home timeperiods including the private activities before and after work, see build_schedules
+        with phase("schedules"):
+            for e, schedule in zip(self.employees, build_schedules(self.employees)):
+                e.schedule = schedule
+
+        with phase("meetings"):
+            self._create_external_meetings()
 
     def _create_external_meetings(self):
         """
@@ -126,16 +276,24 @@ class Company(object):
         mc = MeetingCoordinator()# TODO: The remaining workers join those meetings.
 
         for e in self.employees:
-            logging.info("CREATE {:} {:}: {:} weekly hours, {:} meeting hours".format(e.type.name, e.id, e.weekly_minutes / 60,  e.meeting_minutes / 60))
-            create_private_activity_for_employee(e)
+            logging.info("CREATE %s %s: %s weekly hours, %s meeting hours", e.type.name, e.id, e.weekly_minutes / 60,  e.meeting_minutes / 60)
             mc.create_meetings_for(e)
-            logging.info("FINISH {:} {:}: {:} weekly hours, {:} meeting hours".format(e.type.name, e.id, e.weekly_minutes/60, e.meeting_minutes/60))
-        logging.info("{:} external meetings created".format(len(mc.meetings)))
+            logging.info("FINISH %s %s: %s weekly hours, %s meeting hours", e.type.name, e.id, e.weekly_minutes/60, e.meeting_minutes/60)
+        logging.info("%s external meetings created", len(mc.meetings))
+        record("meetings", len(mc.meetings))
 
     def _create(self, c, type, unique_id):
-        for i in range(c):
-            office = int(choice(self.offices))
-            self.employees.append(create_employee(next(unique_id), office, type))
+        offices = choice(self.offices, size=c).tolist()
+        for office, attributes in zip(offices, draw_employee_attributes(c, type)):
+            self.add_employee(create_employee(next(unique_id), office, type, attributes))
+
+    def add_employee(self, e):
+        assert e.id not in self.employees_by_id
+        self.employees.append(e)
+        self.employees_by_id[e.id] = e
+
+    def get_employee(self, id):
+        return self.employees_by_id[id]
 
     def sum_cars(self):
         return self.fleet.sum_cars
@@ -167,15 +325,19 @@ class Employee(object):
         self.mot_preferences = mot_prefs
         self.daily_minutes = round((self.weekly_minutes / self.working_days), 2)
 
-        self.schedule = Schedule()
-        for i in range(self.working_days):
-            work_begin = self.begin + i * 1440
-            work_end = work_begin + self.daily_minutes
-            arrival_home = work_end + ds.TT_BUFFER_MIN
-            next_day_work_begin = self.begin + (i + 1) * 1440 - ds.TT_BUFFER_MIN
+        # a work timeperiod from begin and a home timeperiod until the next day's work per working day,
+        # built by build_schedules on first access unless a schedule is set before
+        self._schedule = None
+
+    @property
+    def schedule(self):
+        if self._schedule is None:
+            self._schedule = build_schedules([self], private_activities=False)[0]
+        return self._schedule
 
-            self.schedule.add(Timeperiod(work_begin, work_end, self.office, ActivityType.work))
-            self.schedule.add(Timeperiod(arrival_home, next_day_work_begin, self.home, ActivityType.home))
+    @schedule.setter
+    def schedule(self, schedule):
+        self._schedule = schedule
 
     def replace_in_schedule(self, workperiod, meeting):
         leave_for_meeting = meeting.begin - ds.TT_BUFFER_MIN
@@ -197,7 +359,7 @@ class Employee(object):
         d["gender"] = self.gender.name
         d.update(self.mot_preferences.to_types_dict())
 
-        d.pop("schedule")
+        d.pop("_schedule")
         d.pop("mot_preferences")
         return d
 
@@ -211,30 +373,70 @@ class MeetingCoordinator(object):
         self.p_joins_meeting = [p_joins_meeting, 1-p_joins_meeting]
         self.meetings = []
         self.joined_meetings = []
+        self._meetings_by_end = dict()  # end -> indices of the meetings ending then, in order of creation
 
     def create_meeting(self, begin, end, location):
         m = Timeperiod(begin, end, location, ActivityType.meeting)
+        self._meetings_by_end.setdefault(end, []).append(len(self.meetings))
         self.meetings.append(m)
         return m
 
+    def _queue_meetings(self, candidates, queued, ends, after):
+        """
+        merges the meetings ending at ends lazily into the heap of candidates: only the first meeting created
+        after meeting after of each end is pushed, the next one of that end is pushed when it is popped
+        """
+        for end in ends:
+            meetings = self._meetings_by_end.get(end)
+            if end in queued or meetings is None:
+                continue
+            queued.add(end)
+            pos = bisect_right(meetings, after)
+            if pos < len(meetings):
+                heappush(candidates, (meetings[pos], end, pos))
+
+    def _pop_meeting(self, candidates):
+        k, end, pos = heappop(candidates)
+        meetings = self._meetings_by_end[end]
+        if pos + 1 < len(meetings):
+            heappush(candidates, (meetings[pos + 1], end, pos + 1))
+        return k
+
     def try_to_join_existing_meetings(self, employee):
-        max_join = choice(list(range(0, 7)))
+        """
+        only meetings ending together with a work period of the employee can be joined, they are looked up by end
+        and visited in the order of their creation. joining splits the work period, so later meetings
+        ending at the end of its remaining part become candidates as well.
+        """
+        max_join = randint(7)
         i = 0
 
-        for m in self.meetings:
-            for wp in employee.schedule.get_all(ActivityType.work):
+        work_periods = _group_by_end(employee.schedule.get_all(ActivityType.work))
+        candidates, queued = [], set()
+        self._queue_meetings(candidates, queued, work_periods, after=-1)
+
+        while candidates and i < max_join and employee.meeting_minutes > 0:
+            k = self._pop_meeting(candidates)
+            m = self.meetings[k]
+            joined = False
+
+            for wp in work_periods.get(m.end, []):
                 wbm = 15
                 meeting_duration = m.minutes()
 
                 if i < max_join and employee.meeting_minutes > 0 \
-                        and m.end == wp.end \
                         and (wp.begin+wbm+ds.TT_BUFFER_MIN) <= m.begin:
                     if bool(choice(self.joins_meeting, p=self.p_joins_meeting)):
-                        logging.info("joined {:}".format(m))
+                        logging.info("joined %s", m)
 
                         employee.replace_in_schedule(wp, m)
                         i += 1
                         employee.meeting_minutes -= meeting_duration
+                        joined = True
+
+            if joined:
+                work_periods = _group_by_end(employee.schedule.get_all(ActivityType.work))
+                self._queue_meetings(candidates, queued, work_periods, after=k)
 
     def update_worker_schedule(self, e, workperiod, meeting_dur, work_before_meet):
         meeting_loc = ds.office_location(exclude=[workperiod.loc])
@@ -258,11 +460,12 @@ class MeetingCoordinator(object):
 
         retries = 30
         while retries > 0:
-            workperiod = choice(e.schedule.get_all(ActivityType.work))  # pick random work period
+            work_periods = e.schedule.get_all(ActivityType.work)
+            workperiod = work_periods[randint(len(work_periods))]  # pick random work period, same draw as choice(work_periods)
             meeting_dur = min(ds.pick_meeting_duration(), e.meeting_minutes)
             retries -= 1
 
-            before_meeting = int(choice([30, 60, 90]))
+            before_meeting = [30, 60, 90][randint(3)]
             if e.meeting_minutes > 0 and ds.fits_inside(workperiod.minutes(), before_meeting, meeting_dur):
                 self.update_worker_schedule(e, workperiod, meeting_dur, work_before_meet=before_meeting)
 
@@ -279,58 +482,59 @@ def create_company(number_employees, car_types=3, ecar_types=3, offices=1):
     return Company(number_employees, office_location, fleet, boss_perc=0.01, middle_manag=0.1)
 
 
-def create_employee(id, office, emp_type):
-    gender = ds.pick_gender()
-    age = ds.pick_age(gender)
-    weekly_minutes, work_days = ds.weekly_minutes_and_days_per_week(gender, emp_type)
+class EmployeeAttributes(object):
+    def __init__(self, gender, age, weekly_minutes, work_days, begin, home, meeting_perc, mot_preferences):
+        self.gender = gender
+        self.age = age
+        self.weekly_minutes = weekly_minutes
+        self.work_days = work_days
+        self.begin = begin
+        self.home = home
+        self.meeting_perc = meeting_perc
+        self.mot_preferences = mot_preferences
 
-    begin = ds.work_begin()
-    home = ds.home_location()
-    mp = ds.create_mot_preferences_vienna(gender)
+
+def draw_employee_attributes(number_employees, emp_type):
+    """
+    draws the demographic attributes of number_employees employees of type emp_type at once, attribute by attribute
+    """
+    genders = ds.pick_genders(number_employees)
+    ages = ds.pick_ages(genders).tolist()
+    weekly_minutes, work_days = ds.pick_weekly_minutes_and_days(genders, emp_type)
+    begins = ds.work_begins(number_employees).tolist()
+    homes = ds.home_locations(number_employees).tolist()
 
     mu = emp_type.value
     sigma = mu/6
-    perc = pick_from_normal(mu, sigma)
-    meeting_minutes = max(0, round_to_minutes(weekly_minutes*perc, minutes=30))  # np.ceil(weekly_minutes*perc)//30*30
-
-    return Employee(id, age, gender, emp_type, weekly_minutes, begin, work_days, meeting_minutes, home, office, mp)
-
-
-def create_private_activity_for_employee(e):
-    for w in e.schedule.get_all(ActivityType.home):
-        if ds.private_meeting_morning():
-            create_activity_morning(w, e.schedule, exclude_locs=[e.home, e.office])
+    percs = pick_from_normal(mu, sigma, size=number_employees).tolist()
+    mot_preferences = ds.create_mot_preferences_vienna_for(genders)
 
-    for w in e.schedule.get_all(ActivityType.home):
-        if ds.private_meeting_evening():
-            create_activity_evening(w, e.schedule, exclude_locs=[e.home, e.office])
+    return [EmployeeAttributes(*a) for a in zip(genders, ages, weekly_minutes.tolist(), work_days.tolist(), begins, homes, percs,
+                                                 mot_preferences)]
 
 
-def create_activity_morning(w, schedule, exclude_locs, duration=60):
-    loc = ds.home_location(exclude=exclude_locs)
-    dur = duration
-    priv_start = w.end - dur
-    w_end = priv_start - ds.TT_BUFFER_MIN
+def create_employee(id, office, emp_type, attributes=None):
+    if attributes is None:
+        attributes = draw_employee_attributes(1, emp_type)[0]
 
-    schedule.remove(w)
-    schedule.add(Timeperiod(w.begin, w_end, w.loc, ActivityType.home))
-    schedule.add(Timeperiod(priv_start, w.end, loc, ActivityType.private))
+    a = attributes
+    meeting_minutes = max(0, round_to_minutes(a.weekly_minutes*a.meeting_perc, minutes=30))  # np.ceil(weekly_minutes*perc)//30*30
 
+    return Employee(id, a.age, a.gender, emp_type, a.weekly_minutes, a.begin, a.work_days, meeting_minutes, a.home, office, a.mot_preferences)
 
-def create_activity_evening(w, schedule, exclude_locs, duration=120):
-    loc = ds.home_location(exclude=exclude_locs)
-    dur = duration
-    priv_end = w.begin + dur
-    w_start = priv_end + ds.TT_BUFFER_MIN
 
-    schedule.remove(w)
-    schedule.add(Timeperiod(w.begin, priv_end, loc, ActivityType.private))
-    schedule.add(Timeperiod(w_start, w.end, w.loc, ActivityType.home))
+def _group_by_end(timeperiods):
+    groups = dict()
+    for t in timeperiods:
+        groups.setdefault(t.end, []).append(t)
+    return groups
 
 
 def round_to_minutes(x, minutes):
     return ceil(x) // minutes * minutes
 
 
-def pick_from_normal(mu, sigma):
-    return (normal(mu, sigma, 1)[0]) / 100
+def pick_from_normal(mu, sigma, size=None):
+    if size is None:
+        return (normal(mu, sigma, 1)[0]) / 100
+    return normal(mu, sigma, size) / 100
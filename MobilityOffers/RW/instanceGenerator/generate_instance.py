@@ -1,12 +1,15 @@
-from entities import create_company
+from entities import create_company, ACTIVITY_TYPES
 from distancematrix import DistanceMatrix, MoT
 from numpy.random import choice
 from i_utils import to_date
-from mobilityOfferGenerator import createMobilityOfferInstance
+from mobilityOfferGenerator import writeMobilityOfferInstance, getOfferArrayPrefix, TRIP_DTYPE
+from instrumentation import recording, phase, record, logging_enabled, REPORT_FILE
+import numpy as np
 import os
 import csv
 import json
 import logging
+import random
 import sys
 
 
@@ -15,25 +18,17 @@ import sys
 - employees are uniformly distributed over all office locations.
 """
 
-NUMBER_OF_EMPLOYEES = choice(range(10, 500))
-# read number of employees as first parameter
-if len(sys.argv) > 1:
-    NUMBER_OF_EMPLOYEES = int(sys.argv[1])
-
-INSTANCE_NUMBER = 0
-if len(sys.argv) > 2:
-    INSTANCE_NUMBER = int(sys.argv[2])
-
-print(sys.argv)
-
 OFFICES = 2
 
-INSTANCE_DIRECTORY = "./instances/E" + str(NUMBER_OF_EMPLOYEES) + "_" + str(INSTANCE_NUMBER)
+INSTANCE_ROOT = "./instances"
 
-logfile = os.path.join(INSTANCE_DIRECTORY, "instancegeneration.log")
 log_format= "%(asctime)-15s %(levelname)s\t(%(filename)s:%(lineno)d) -  %(message)s"
 
 
+def instance_directory(number_of_employees, instance_number):
+    return os.path.join(INSTANCE_ROOT, "E" + str(number_of_employees) + "_" + str(instance_number))
+
+
 def ensure_empty_target_dir_exists(dir):
     if not os.path.exists(dir):
         os.makedirs(dir)
@@ -51,16 +46,38 @@ def prepare_mot_preferences(employees):
 
 
 def prepare_trips(employees, matrix):
-    d = []
+    """ returns the trips of all employees as one table of TRIP_DTYPE rows, one row per timeperiod of their schedules """
+    users, locs, types, begins, ends = [], [], [], [], []
+    type_codes = {a: i for i, a in enumerate(ACTIVITY_TYPES)}
+    log = logging_enabled()
     for e in employees:
-        logging.info(e.to_dict())
+        if log:
+            logging.info(e.to_dict())
 
         for w in e.schedule.get():
-            node = matrix.get_node(w.loc)
-            dur = w.end-w.begin
-            d.append(entry(e.id, w.loc, node.lon(), node.lat(), w.activity, w.begin, w.end, dur))
-            logging.info("\t{:} {:} - {:} dur {:}h loc {:} ".format(w.activity.value[:4], to_date(w.begin), to_date(w.end), dur/60, w.loc))
-    return d
+            users.append(e.id)
+            locs.append(w.loc)
+            types.append(type_codes[w.activity])
+            begins.append(w.begin)
+            ends.append(w.end)
+            if log:
+                logging.info("\t%s %s - %s dur %sh loc %s ", w.activity.value[:4], to_date(w.begin), to_date(w.end), (w.end-w.begin)/60, w.loc)
+
+    trips = np.zeros(len(users), dtype=TRIP_DTYPE)
+    trips["assignedUser"] = users
+    trips["id"] = locs
+    trips["type"] = types
+    trips["latestArrival"] = begins
+    trips["earliestDeparture"] = ends
+    trips["serviceDuration"] = trips["earliestDeparture"] - trips["latestArrival"]
+
+    # look up each distinct location only once
+    ids, inverse = np.unique(trips["id"], return_inverse=True)
+    nodes = [matrix.get_node(i) for i in ids.tolist()]
+    trips["node"] = np.array([matrix.node_index[i] for i in ids.tolist()], dtype=np.int64)[inverse]
+    trips["coordinateX"] = np.array([n.lon() for n in nodes])[inverse]
+    trips["coordinateY"] = np.array([n.lat() for n in nodes])[inverse]
+    return trips
 
 
 def entry(i, h, lon, lat, t, arr, dep, dur):
@@ -68,8 +85,14 @@ def entry(i, h, lon, lat, t, arr, dep, dur):
             "earliestDeparture": dep, "latestArrival": arr, "serviceDuration": dur}
 
 
-def write_csv(fn, list, sep=";"):
-    filename = os.path.join(INSTANCE_DIRECTORY, fn+".csv")
+def trip_dicts(trips):
+    """ returns the rows of a trips table as entry dictionaries, e.g. for write_csv """
+    return [entry(i, h, lon, lat, ACTIVITY_TYPES[t], arr, dep, dur)
+            for i, h, _, lon, lat, t, dep, arr, dur in trips.tolist()]
+
+
+def write_csv(directory, fn, list, sep=";"):
+    filename = os.path.join(directory, fn+".csv")
 
     if not type(list[0]) is dict:
         list = [d.to_dict() for d in list]
@@ -85,8 +108,8 @@ def write_csv(fn, list, sep=";"):
             writer.writerow(entry)
 
 
-def write_json(fn, d, indent=0):
-    filename = os.path.join(INSTANCE_DIRECTORY, fn+".json")
+def write_json(directory, fn, d, indent=0):
+    filename = os.path.join(directory, fn+".json")
 
     if type(d) is list:
         data = [x.to_dict() for x in d]
@@ -98,30 +121,83 @@ def write_json(fn, d, indent=0):
         jsonfile.write(json.dumps(data, indent=indent))
 
 
-def write_mobilityOfferInstance(fn, d, indent=0):
-    filename = os.path.join(INSTANCE_DIRECTORY, fn)
-    data = d
-    with open(filename, 'w') as file:
-        file.write(data)
-
-
-try:
-    ensure_empty_target_dir_exists(INSTANCE_DIRECTORY)
-    logging.basicConfig(filename=logfile, level=20, format=log_format)
-except Exception as e:
-    print(e)
-
-
-matrix = DistanceMatrix()
-company = create_company(NUMBER_OF_EMPLOYEES, car_types=3, ecar_types=3, offices=OFFICES)
-trips = prepare_trips(company.employees, matrix)
-
-mobilityOfferInstance = createMobilityOfferInstance(company, MoT.manager.to_list(), trips, matrix)
-
-#write_csv("moveOptions", matrix.move_options)
-#write_csv("motDependentNodeInfos", prepare_mot_preferences(company.employees))
-#write_csv("nodes", trips)
-#write_json("mots", MoT.manager.to_list())
-#write_json("employees", company.employees)
-#write_json("company", company)
-write_mobilityOfferInstance("E" + str(NUMBER_OF_EMPLOYEES) + "_C0.15_" + str(INSTANCE_NUMBER) + ".mo.input", mobilityOfferInstance)
\ No newline at end of file
+def write_mobilityOfferInstance(directory, fn, company, mots, trips, matrix, binary=False):
+    filename = os.path.join(directory, fn)
+    with open(filename, 'w', buffering=1024*1024) as file:
+        writeMobilityOfferInstance(file, company, mots, trips, matrix,
+                                   binary=getOfferArrayPrefix(filename) if binary else None)
+
+
+def generate_instance(number_of_employees, instance_number, offices=OFFICES, seed=None, matrix=None, binary=False,
+                      log_level=logging.INFO):
+    """
+    generates one instance into its own directory below INSTANCE_ROOT.
+    the random number generators are seeded with seed if given, a matrix can be passed in to be reused across instances.
+    with binary=True the mobility offer instance is additionally written as memory-mappable .npy columns.
+    the time and sizes of the generation phases are written to REPORT_FILE next to instancegeneration.log,
+    which only gets the messages of at least log_level.
+    """
+    directory = instance_directory(number_of_employees, instance_number)
+
+    handler = None
+    try:
+        ensure_empty_target_dir_exists(directory)
+        handler = logging.FileHandler(os.path.join(directory, "instancegeneration.log"))
+        handler.setFormatter(logging.Formatter(log_format))
+        logging.getLogger().addHandler(handler)
+        logging.getLogger().setLevel(log_level)
+    except Exception as e:
+        print(e)
+
+    try:
+        with recording(employees=number_of_employees, instance=instance_number, offices=offices, seed=seed,
+                       binary=binary) as report:
+            generate_files(directory, number_of_employees, instance_number, offices, seed, matrix, binary)
+        logging.info("generation phases (s): %s", report.phases)
+        report.write(os.path.join(directory, REPORT_FILE))
+    finally:
+        if handler is not None:
+            logging.getLogger().removeHandler(handler)
+            handler.close()
+
+
+def generate_files(directory, number_of_employees, instance_number, offices, seed, matrix, binary):
+    if seed is not None:
+        np.random.seed(seed)
+        random.seed(seed)
+
+    if matrix is None:
+        with phase("matrix"):
+            matrix = DistanceMatrix()
+    with phase("company"):
+        company = create_company(number_of_employees, car_types=3, ecar_types=3, offices=offices)
+    record("employees", len(company.employees))
+    with phase("trips"):
+        trips = prepare_trips(company.employees, matrix)
+    record("trips", len(trips))
+
+    #write_csv(directory, "moveOptions", matrix.move_options)
+    #write_csv(directory, "motDependentNodeInfos", prepare_mot_preferences(company.employees))
+    #write_csv(directory, "nodes", trip_dicts(trips))
+    #write_json(directory, "mots", MoT.manager.to_list())
+    #write_json(directory, "employees", company.employees)
+    #write_json(directory, "company", company)
+    fn = "E" + str(number_of_employees) + "_C0.15_" + str(instance_number) + ".mo.input"
+    with phase("write"):
+        write_mobilityOfferInstance(directory, fn, company, MoT.manager.to_list(), trips, matrix, binary=binary)
+    record("bytes", os.path.getsize(os.path.join(directory, fn)))
+
+
+if __name__ == "__main__":
+    NUMBER_OF_EMPLOYEES = choice(range(10, 500))
+    # read number of employees as first parameter
+    if len(sys.argv) > 1:
+        NUMBER_OF_EMPLOYEES = int(sys.argv[1])
+
+    INSTANCE_NUMBER = 0
+    if len(sys.argv) > 2:
+        INSTANCE_NUMBER = int(sys.argv[2])
+
+    print(sys.argv)
+
+    generate_instance(NUMBER_OF_EMPLOYEES, INSTANCE_NUMBER, offices=OFFICES)
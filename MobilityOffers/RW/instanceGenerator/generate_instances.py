@@ -0,0 +1,65 @@
+from distancematrix import DistanceMatrix
+from generate_instance import generate_instance, OFFICES
+from itertools import product
+import argparse
+import logging
+import multiprocessing
+import time
+
+
+"""
+generates a grid of instances (number of employees x instance number) in parallel, one instance per task.
+each worker process builds its distance matrix once from the memory-mapped aerial distance cache
+and reuses it for all of its instances.
+
+example: python generate_instances.py --employees 10 50 100 --instances 0 1 2 --seed 42
+"""
+
+_matrix = None
+_binary = False
+_log_level = logging.INFO
+
+
+def _init_worker(binary=False, log_level=logging.INFO):
+    global _matrix, _binary, _log_level
+    _matrix = DistanceMatrix()
+    _binary = binary
+    _log_level = log_level
+
+
+def _generate(task):
+    number_of_employees, instance_number, offices, seed = task
+    start = time.time()
+    generate_instance(number_of_employees, instance_number, offices=offices, seed=seed, matrix=_matrix, binary=_binary,
+                      log_level=_log_level)
+    return task, time.time() - start
+
+
+def create_grid(employees, instances, offices=OFFICES, seed=0):
+    """ returns one (employees, instance number, offices, seed) task per combination, each with its own seed """
+    return [(e, i, offices, seed + k) for k, (e, i) in enumerate(product(employees, instances))]
+
+
+def run(grid, processes=None, binary=False, log_level=logging.INFO):
+    # fill the aerial distance cache once, so the workers only map it
+    DistanceMatrix()
+
+    with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(binary, log_level)) as pool:
+        for k, (task, duration) in enumerate(pool.imap_unordered(_generate, grid)):
+            print("[{:}/{:}] E{:}_{:} (offices {:}, seed {:}) generated in {:.2f}s".format(k + 1, len(grid), *task, duration))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="generates a grid of instances in parallel")
+    parser.add_argument("--employees", type=int, nargs="+", required=True, help="numbers of employees")
+    parser.add_argument("--instances", type=int, nargs="+", default=[0], help="instance numbers")
+    parser.add_argument("--offices", type=int, default=OFFICES, help="number of offices")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first instance, incremented per instance")
+    parser.add_argument("--processes", type=int, default=None, help="number of worker processes (default: all cores)")
+    parser.add_argument("--binary", action="store_true", help="additionally write the instances as binary .npy columns")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="minimum level of the messages written to instancegeneration.log")
+    args = parser.parse_args()
+
+    run(create_grid(args.employees, args.instances, offices=args.offices, seed=args.seed), processes=args.processes,
+        binary=args.binary, log_level=getattr(logging, args.log_level))
@@ -0,0 +1,92 @@
+from contextlib import contextmanager
+import json
+import logging
+import time
+
+
+"""
+per-phase timers and sizes of an instance generation, collected into the report of the current generation
+(see recording) and written as json next to instancegeneration.log.
+phases are exclusive: the time of a phase nested into another one is only counted for the inner phase.
+without a current report, phases and sizes are not recorded at all.
+
+log calls pass their arguments %-style, so messages are only formatted if their level is enabled,
+arguments that are expensive to compute are guarded with logging_enabled.
+"""
+
+REPORT_FILE = "instancegeneration.json"
+
+_report = None
+_END = object()
+
+
+class Report(object):
+    def __init__(self, **parameters):
+        self.parameters = parameters
+        self.phases = dict()  # name -> seconds
+        self.sizes = dict()  # name -> number
+        self.nested = 0.0  # seconds spent in phases nested into the running one
+
+    def add_time(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def total(self):
+        return sum(self.phases.values())
+
+    def to_dict(self):
+        return {"parameters": self.parameters, "phases": self.phases, "total": self.total(), "sizes": self.sizes}
+
+    def write(self, filename):
+        with open(filename, 'w') as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+
+@contextmanager
+def recording(**parameters):
+    """ makes a new report with the given parameters the current one while the with block runs """
+    global _report
+    previous = _report
+    _report = Report(**parameters)
+    try:
+        yield _report
+    finally:
+        _report = previous
+
+
+@contextmanager
+def phase(name):
+    """ adds the time the with block takes, except the time of nested phases, to phase name of the current report """
+    report = _report
+    if report is None:
+        yield
+        return
+
+    outer_nested, report.nested = report.nested, 0.0
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        report.add_time(name, elapsed - report.nested)
+        report.nested = outer_nested + elapsed
+
+
+def timed(name, iterable):
+    """ yields the items of iterable, adding the time spent producing them to phase name """
+    iterator = iter(iterable)
+    while True:
+        with phase(name):
+            item = next(iterator, _END)
+        if item is _END:
+            return
+        yield item
+
+
+def record(name, value):
+    """ sets size name of the current report """
+    if _report is not None:
+        _report.sizes[name] = value
+
+
+def logging_enabled(level=logging.INFO):
+    return logging.getLogger().isEnabledFor(level)
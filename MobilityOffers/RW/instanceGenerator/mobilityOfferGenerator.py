@@ -1,8 +1,11 @@
-from entities import ActivityType
+from entities import ActivityType, ACTIVITY_TYPES
 from mot import unlimitedNumber
-from itertools import groupby
+from distancematrix import LazyMoveOptions
+from instrumentation import phase, timed, record
 from math import floor, ceil
-from itertools import chain
+import numpy as np
+from numpy.lib.format import open_memmap
+import os
 
 """
 generates a mobility offer instance from the data of the created company
@@ -17,17 +20,20 @@ CAR_TO_INDEX = {'Type.BIKE_Bike': 'n_bikes', 'Type.ICEV_CarSmall': 'car_0', 'Typ
 
 COST_PER_TIME_REDUCTION_PRIVATE = 0.2
 
-motLine = []
+BATCH_SIZE = 4096  # number of demand windows whose offers are computed at once
 
 """
-Needed for easy initialization of 3d-dictionary (for matrix)
-source: https://stackoverflow.com/questions/635483/what-is-the-best-way-to-implement-nested-dictionaries
+trips are a structured array with one row per schedule item, the node being the index of the location in the distance matrix
+and the type the index of the ActivityType in ACTIVITY_TYPES
 """
-class Vividict(dict):
-    def __missing__(self, key):
-        value = self[key] = type(self)() # retain local pointer to value
-        return value                     # faster to return than dict lookup
+TRIP_DTYPE = np.dtype([("assignedUser", np.int64), ("id", np.int64), ("node", np.int64),
+                       ("coordinateX", np.float64), ("coordinateY", np.float64), ("type", np.int8),
+                       ("earliestDeparture", np.float64), ("latestArrival", np.float64), ("serviceDuration", np.float64)])
+
+WORK = ACTIVITY_TYPES.index(ActivityType.work)
+MEETING = ACTIVITY_TYPES.index(ActivityType.meeting)
 
+motLine = []
 
 class MoTLine (object):
     def __init__(self, id):
@@ -51,6 +57,98 @@ class Offer (object):
         return str(self.cost) + " " + str(self.start) + " " + str(self.end) + " " + str(self.motIdx)
 
 
+class OfferArrays (object):
+    """
+    columnar (CSR) representation of the demands of an instance with fixed dtypes,
+    the offers of demand d are the entries demandOffsets[d]:demandOffsets[d+1] of the offer columns
+    """
+    COLUMNS = ["header", "motId", "motType", "motNmbAvailable", "motStartIndex",
+               "demandOffsets", "offerCost", "offerStart", "offerEnd", "offerMotIdx"]
+
+    def __init__(self, prefix=None):
+        self.header = np.zeros(4, dtype=np.int64)  # nmbCars nmbDemands nmbOffers nmbMots
+        self.setMoTLines([])
+        self.prefix = None
+        self.allocate(0, 0)
+        self.prefix = prefix
+
+    def allocate(self, nmbDemands, nmbOffers):
+        """
+        allocates the demand and offer columns, to be filled by append.
+        with a prefix, the columns are memory-mapped .npy files (see save), so the offers go to disk as they are appended
+        """
+        self.demandOffsets = self.createColumn("demandOffsets", nmbDemands + 1, np.int64)
+        self.offerCost = self.createColumn("offerCost", nmbOffers, np.float64)
+        self.offerStart = self.createColumn("offerStart", nmbOffers, np.int64)
+        self.offerEnd = self.createColumn("offerEnd", nmbOffers, np.int64)
+        self.offerMotIdx = self.createColumn("offerMotIdx", nmbOffers, np.int64)
+        self.nmbDemands = 0
+
+    def createColumn(self, column, size, dtype):
+        if self.prefix is None:
+            return np.zeros(size, dtype=dtype)
+        return open_memmap(getOfferArrayFile(self.prefix, column), mode="w+", dtype=dtype, shape=(size,))
+
+    def setMoTLines(self, lines):
+        self.motId = np.array([m.id for m in lines], dtype=np.int64)
+        self.motType = np.array([m.type for m in lines], dtype=str)
+        self.motNmbAvailable = np.array([m.nmbAvailable for m in lines], dtype=np.int64)
+        self.motStartIndex = np.array([m.startIndex for m in lines], dtype=np.int64)
+
+    def append(self, offers):
+        """ appends the offers of the next demand """
+        first = self.demandOffsets[self.nmbDemands]
+        last = first + len(offers)
+        self.offerCost[first:last] = [o.cost for o in offers]
+        self.offerStart[first:last] = [o.start for o in offers]
+        self.offerEnd[first:last] = [o.end for o in offers]
+        self.offerMotIdx[first:last] = [o.motIdx for o in offers]
+        self.nmbDemands += 1
+        self.demandOffsets[self.nmbDemands] = last
+
+    def getOffers(self, d):
+        """ returns the (cost, start, end, motIdx) columns of the offers of demand d as views """
+        first, last = self.demandOffsets[d], self.demandOffsets[d + 1]
+        return self.offerCost[first:last], self.offerStart[first:last], self.offerEnd[first:last], self.offerMotIdx[first:last]
+
+    def save(self, prefix):
+        """ writes one .npy file per column, named prefix-column.npy, the columns already mapped to these files are flushed """
+        for column in OfferArrays.COLUMNS:
+            filename = getOfferArrayFile(prefix, column)
+            values = getattr(self, column)
+            if isinstance(values, np.memmap) and values.filename == os.path.abspath(filename):
+                values.flush()
+            else:
+                np.save(filename, values)
+
+    @staticmethod
+    def load(prefix, mmap_mode="r"):
+        """ loads the columns written by save, memory-mapped unless mmap_mode is None """
+        arrays = OfferArrays()
+        for column in OfferArrays.COLUMNS:
+            setattr(arrays, column, np.load(getOfferArrayFile(prefix, column), mmap_mode=mmap_mode))
+        arrays.nmbDemands = len(arrays.demandOffsets) - 1
+        return arrays
+
+
+def getOfferArrayFile(prefix, column):
+    return prefix + "-" + column + ".npy"
+
+
+"""
+returns the prefix of the binary columns written next to the mobility offer instance file filename
+"""
+def getOfferArrayPrefix(filename):
+    return os.path.splitext(filename)[0]
+
+
+"""
+only consider (full) time costs (= personel costs) for work -> meeting and meeting -> work events
+"""
+def isTimeCostRelevant(fromType, toType):
+    return (fromType == ActivityType.work and toType == ActivityType.meeting) or (toType == ActivityType.work and fromType == ActivityType.meeting)
+
+
 """
 compute the cost of an offer for a demand derived from events with mot motID based on cost values of matrix
 """
@@ -58,12 +156,10 @@ def computeOfferCost(mots, motID, events, matrix):
     cost = 0
     currentEvent = events[0]
     for e in events[1:]:
-        cost += matrix[currentEvent["id"]][e["id"]][motID].cost
+        cost += matrix.get(currentEvent["id"], e["id"], motID).cost
         # subtract costs per time for private events
-        # i.e., only consider (full) time costs (= personel costs) for work -> meeting and meeting -> work events
-        timeCostsRelevant = (currentEvent["type"] == ActivityType.work and e["type"] == ActivityType.meeting) or (e["type"] == ActivityType.work and currentEvent["type"] == ActivityType.meeting)
-        if not timeCostsRelevant:
-            cost -= matrix[currentEvent["id"]][e["id"]][motID].duration_seconds * mots[motID].costPerTime * (1.0 - COST_PER_TIME_REDUCTION_PRIVATE)
+        if not isTimeCostRelevant(currentEvent["type"], e["type"]):
+            cost -= matrix.get(currentEvent["id"], e["id"], motID).duration_seconds * mots[motID].costPerTime * (1.0 - COST_PER_TIME_REDUCTION_PRIVATE)
 
         currentEvent = e
 
@@ -78,7 +174,7 @@ compute the start time of an offer for a demand derived from events with mot mot
 def computeOfferStart(mots, motID, events, matrix):
     startEvent = events[0]
     firstEvent = events[1]
-    travelTime = matrix[startEvent["id"]][firstEvent["id"]][motID].duration_seconds
+    travelTime = matrix.get(startEvent["id"], firstEvent["id"], motID).duration_seconds
     start = ceil(firstEvent["latestArrival"] - travelTime / 60.0)
     start -= ceil(mots[motID].overheadDuration / 60.0 / 2.0)
     return start
@@ -87,90 +183,206 @@ def computeOfferStart(mots, motID, events, matrix):
 def computeOfferEnd(mots, motID, events, matrix):
     endEvent = events[-1]
     lastEvent = events[-2]
-    travelTime = matrix[lastEvent["id"]][endEvent["id"]][motID].duration_seconds
+    travelTime = matrix.get(lastEvent["id"], endEvent["id"], motID).duration_seconds
     end = floor(lastEvent["earliestDeparture"] + travelTime / 60.0)
     end += floor(mots[motID].overheadDuration / 60.0 / 2.0)
     return end
 
 
+"""
+compute cost, start and end of the offers of all given demand windows for all mots at once,
+returns three (windows x mots) arrays, mots being indexed by id
+"""
+def computeOfferTables(mots, windows, matrix):
+    trips, offsets = windows.trips, windows.offsets - windows.offsets[0]
+    events = windows.events[windows.offsets[0]:windows.offsets[-1]]
+    nmbWindows = len(offsets) - 1
+
+    # consecutive events of the same window
+    isPair = np.ones(len(events) - 1, dtype=bool)
+    isPair[offsets[1:-1] - 1] = False
+    fromEvents, toEvents = events[:-1][isPair], events[1:][isPair]
+    fromTypes, toTypes = trips["type"][fromEvents], trips["type"][toEvents]
+    relevant = ((fromTypes == WORK) & (toTypes == MEETING)) | ((toTypes == WORK) & (fromTypes == MEETING))
+
+    firstPairs = offsets[:-1] - np.arange(nmbWindows)
+    lastPairs = offsets[1:] - np.arange(1, nmbWindows + 1) - 1
+    arrivals = trips["latestArrival"][events[offsets[:-1] + 1]]
+    departures = trips["earliestDeparture"][events[offsets[1:] - 2]]
+    fromNodes, toNodes = trips["node"][fromEvents], trips["node"][toEvents]
+
+    costPerTime = np.array([m.costPerTime for m in mots], dtype=float)
+    overheadDuration = np.array([m.overheadDuration for m in mots], dtype=float)
+
+    # (pairs x mots) costs and durations of all consecutive event pairs
+    cost = matrix.cost[fromNodes, toNodes]
+    duration = matrix.duration_seconds[fromNodes, toNodes]
+    private = ~relevant
+    cost[private] -= duration[private] * costPerTime * (1.0 - COST_PER_TIME_REDUCTION_PRIVATE)
+
+    costs = overheadDuration * costPerTime + np.add.reduceat(cost, firstPairs, axis=0)
+    starts = np.ceil(arrivals[:, None] - duration[firstPairs] / 60.0) - np.ceil(overheadDuration / 60.0 / 2.0)
+    ends = np.floor(departures[:, None] + duration[lastPairs] / 60.0) + np.floor(overheadDuration / 60.0 / 2.0)
+    return costs, starts.astype(int), ends.astype(int)
+
+
+"""
+returns the ids of the mots accepted by the employee
+"""
+def getAcceptedMotIds(employee):
+    return [m["id"] for m in employee.mot_preferences.to_dict() if m["accepted"] is True]
+
+
+def getNmbOffers(motID):
+    nmbOffers = motLine[motID].nmbAvailable
+    if nmbOffers == unlimitedNumber:
+        nmbOffers = 1
+    return nmbOffers
+
+
+"""
+returns the offers of mot motID with the given cost, start and end
+"""
+def createOffers(motID, cost, start, end):
+    # generate nmbOffers offers for MoT type m, one per mot index
+    return [Offer(cost, start, end, motLine[motID].startIndex + i) for i in range(0, getNmbOffers(motID))]
+
+
 """
 returns a list of offers for the given list of work - work events  
 """
 def getOffersFromEvents(events, mots, employee, matrix):
 
     offers = []
-    mot_prefs = employee.mot_preferences
+    for motID in getAcceptedMotIds(employee):
+        cost = computeOfferCost(mots, motID, events, matrix)
+        start = computeOfferStart(mots, motID, events, matrix)
+        end = computeOfferEnd(mots, motID, events, matrix)
+        offers.extend(createOffers(motID, cost, start, end))
 
-    for m in mot_prefs.to_dict():
-        # create offer if user accepts this mot
-        if m["accepted"] is True:
+    return offers
 
-            # get nmb offers
-            nmbOffers = motLine[m["id"]].__dict__["nmbAvailable"]
-            if nmbOffers == unlimitedNumber:
-                nmbOffers = 1
 
-            # compute cost
-            cost = computeOfferCost(mots, motLine[m["id"]].id, events, matrix)
+class DemandWindows (object):
+    """
+    windows of events from one work event to the next one, the events of window w are the rows
+    events[offsets[w]:offsets[w+1]] of trips, the window belongs to users[w]
+    """
+    def __init__(self, trips, users, offsets, events):
+        self.trips = trips
+        self.users = users
+        self.offsets = offsets
+        self.events = events
 
-            # compute start
-            start = computeOfferStart(mots, motLine[m["id"]].id, events, matrix)
+    def __len__(self):
+        return len(self.users)
 
-            # compute end
-            end = computeOfferEnd(mots, motLine[m["id"]].id, events, matrix)
+    def __getitem__(self, w):
+        """ returns the user and the rows of trips of window w """
+        return self.users[w], self.events[self.offsets[w]:self.offsets[w + 1]]
 
-            # generate nmbOffers offers for MoT type m
-            for i in range(0, nmbOffers):
-                # compute mot index
-                motIndex =  motLine[m["id"]].__dict__["startIndex"] + i
-                o = Offer(cost, start, end, motIndex)
-                offers.append(o)
+    def slice(self, first, last):
+        """ returns the windows first to last (exclusive) without copying the events """
+        return DemandWindows(self.trips, self.users[first:last], self.offsets[first:last + 1], self.events)
 
-    return offers
 
+"""
+splits the trips of each user into windows of events from one work event to the next one,
+returns the DemandWindows, the rows of their trips being the given trips followed by one artificial final event per user
+"""
+def getDemandWindows(trips):
+
+    # events of each user by arrival, in the order of trips for equal arrival
+    order = np.lexsort((trips["latestArrival"], trips["assignedUser"]))
+    users = trips["assignedUser"][order]
+    isFirst = np.ones(len(order), dtype=bool)
+    isFirst[1:] = users[1:] != users[:-1]
+    userStarts = np.flatnonzero(isFirst)
+
+    # add (artificial) final work event - first work event of the following week
+    finalEvents = trips[order[userStarts]].copy()
+    finalEvents["latestArrival"] = finalEvents["latestArrival"] + 7*24*60
+    finalEvents["earliestDeparture"] = finalEvents["latestArrival"] + 7*24*60
+    finalRows = len(trips) + np.arange(len(userStarts))
+
+    # a window ends at (and the next one starts with) each work event except the first one of a user
+    isWork = trips["type"][order] == WORK
+    nmbPreviousWork = np.cumsum(isWork) - isWork
+    nmbPreviousWork -= np.repeat(nmbPreviousWork[userStarts], np.diff(np.append(userStarts, len(order))))
+    isCut = isWork & (nmbPreviousWork >= 1)
+
+    starts = np.flatnonzero(isFirst | isCut)
+    isLast = np.append(isFirst[starts[1:]], True)  # last window of its user
+    ends = np.append(starts[1:], len(order)) - isLast  # last event of each window, inclusive
+    lengths = ends - starts + 1 + isLast  # the last window of a user additionally gets the final event
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+    positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+    isFinal = np.zeros(offsets[-1], dtype=bool)
+    isFinal[offsets[1:][isLast] - 1] = True
+    events = np.empty(offsets[-1], dtype=np.int64)
+    events[~isFinal] = order[positions[~isFinal]]
+    events[isFinal] = finalRows
+
+    return DemandWindows(np.concatenate([trips, finalEvents]), users[starts], offsets, events)
 
-def generateMobilityDemands(t, mots, employees, matrix):
 
-    mobilityDemands = []
-    t.sort(key=lambda x: (x["assignedUser"], x["latestArrival"]))
+"""
+returns the events of the given rows of trips as dictionaries
+"""
+def getEvents(trips, rows):
+    events = [dict(zip(TRIP_DTYPE.names, t)) for t in trips[rows].tolist()]
+    for event in events:
+        event["type"] = ACTIVITY_TYPES[event["type"]]
+    return events
 
-    for user, g in groupby(t, lambda x: x["assignedUser"]):
-        entry = []
-        eventsOfUser = list(g)
-        eventsOfUser.sort(key=lambda x: x["latestArrival"])
 
-        nmbWorkEvents = 0
-        for event in eventsOfUser:
-            mobilityOffers = []
-            entry.append(event)
+"""
+returns the number of offers generated for the given demand windows
+"""
+def countOffers(windows, company):
+    nmbOffers = 0
+    nmbOffersOfUser = dict()
+    for user in windows.users.tolist():
+        if user not in nmbOffersOfUser:
+            nmbOffersOfUser[user] = sum(getNmbOffers(motID) for motID in getAcceptedMotIds(company.get_employee(user)))
+        nmbOffers += nmbOffersOfUser[user]
+    return nmbOffers
 
-            if event["type"] == ActivityType.work:
-                nmbWorkEvents += 1
 
-            if nmbWorkEvents == 2:
-                mobilityOffers.extend(getOffersFromEvents(entry, mots, next(x for x in employees if x.id == user), matrix))
-                # start with same event again
-                entry = [event]
-                nmbWorkEvents = 1
-                mobilityDemands.append(list(mobilityOffers))
+"""
+yields the list of offers of each demand window, batched computations are done for at most BATCH_SIZE windows at once
+"""
+def generateMobilityDemands(windows, mots, company, matrix, batched=True):
 
-        # add (artificial) final work event - first work event of the following week
-        finalEvent = eventsOfUser[0].copy()
-        finalEvent["latestArrival"] = finalEvent["latestArrival"] + 7*24*60
-        finalEvent["earliestDeparture"] = finalEvent["latestArrival"] + 7*24*60
-        entry.append(finalEvent)
-        mobilityOffers.extend(getOffersFromEvents(entry, mots, next(x for x in employees if x.id == user), matrix))
-        mobilityDemands.append(list(mobilityOffers))
+    if not batched:
+        # prepare matrix, move options are only created for the trips that actually occur
+        lookup = LazyMoveOptions(matrix)
+        for w in range(len(windows)):
+            user, rows = windows[w]
+            yield getOffersFromEvents(getEvents(windows.trips, rows), mots, company.get_employee(int(user)), lookup)
+        return
 
-    return mobilityDemands
+    acceptedMotIds = dict()
+    for first in range(0, len(windows), BATCH_SIZE):
+        batch = windows.slice(first, first + BATCH_SIZE)
+        costs, starts, ends = computeOfferTables(mots, batch, matrix)
+        costs, starts, ends = costs.tolist(), starts.tolist(), ends.tolist()
 
+        for k, user in enumerate(batch.users.tolist()):
+            if user not in acceptedMotIds:
+                acceptedMotIds[user] = getAcceptedMotIds(company.get_employee(user))
 
-def createMobilityOfferInstance(company, mots, trips, matrix):
-    nmbCars = company.sum_cars() + company.sum_ecars()
-    nmbMots = len(mots)
+            offers = []
+            for motID in acceptedMotIds[user]:
+                offers.extend(createOffers(motID, costs[k][motID], starts[k][motID], ends[k][motID]))
+            yield offers
 
+
+def prepareMoTLines(company, mots):
     mots.sort(key=lambda x: x.id)
 
+    del motLine[:]
     index = 0
     for mot in mots:
 
@@ -189,24 +401,50 @@ def createMobilityOfferInstance(company, mots, trips, matrix):
         else:
             index += m.nmbAvailable
 
-    # prepare matrix
-    prepMatrix = Vividict()
-    for row in matrix.move_options:
-        prepMatrix[row.fromNode][row.toNode][row.modeOfTransport] = row
 
-    mobilityDemands = generateMobilityDemands(trips, mots, company.employees, prepMatrix)
+"""
+yields the lines of the mobility offer instance one by one,
+the header counts are computed in a first pass over the demand windows without computing any offer.
+if arrays is given, the demands are additionally appended to it (see OfferArrays), it is complete once all lines are consumed
+"""
+def iterMobilityOfferInstance(company, mots, trips, matrix, batched=True, arrays=None):
+    nmbCars = company.sum_cars() + company.sum_ecars()
+    nmbMots = len(mots)
+
+    with phase("offers"):
+        prepareMoTLines(company, mots)
+        windows = getDemandWindows(trips)
+
+        nmbDemands = len(windows)
+        nmbOffers = countOffers(windows, company)
+    record("demands", nmbDemands)
+    record("offers", nmbOffers)
 
-    nmbDemands = len(mobilityDemands)
-    nmbOffers = len(list(chain.from_iterable(mobilityDemands)))
+    if arrays is not None:
+        arrays.allocate(nmbDemands, nmbOffers)
+        arrays.header[:] = [nmbCars, nmbDemands, nmbOffers, nmbMots]
+        arrays.setMoTLines(motLine)
 
-    mobilityOfferInstance = [str(nmbCars) + " " + str(nmbDemands) + " " + str(nmbOffers) + " " + str(nmbMots) + "\n"]
+    yield str(nmbCars) + " " + str(nmbDemands) + " " + str(nmbOffers) + " " + str(nmbMots) + "\n"
     for m in motLine:
-        mobilityOfferInstance.append(m.toString() + "\n")
+        yield m.toString() + "\n"
+
+    for d in timed("offers", generateMobilityDemands(windows, mots, company, matrix, batched=batched)):
+        if arrays is not None:
+            arrays.append(d)
+        yield str(len(d)) + " " + "".join(o.toString() + " " for o in d) + "\n"
+
 
-    for d in mobilityDemands:
-        mobilityOfferInstance.append(str(len(d)) + " ")
-        for o in d:
-            mobilityOfferInstance.append(o.toString() + " ")
-        mobilityOfferInstance.append("\n")
+def createMobilityOfferInstance(company, mots, trips, matrix, batched=True):
+    return ''.join(iterMobilityOfferInstance(company, mots, trips, matrix, batched=batched))
 
-    return ''.join(mobilityOfferInstance)
\ No newline at end of file
+
+"""
+writes the mobility offer instance to the given (buffered) file, demand by demand.
+if binary is given, the instance is additionally written as binary columns with this prefix (see OfferArrays)
+"""
+def writeMobilityOfferInstance(file, company, mots, trips, matrix, batched=True, binary=None):
+    arrays = None if binary is None else OfferArrays(binary)
+    file.writelines(iterMobilityOfferInstance(company, mots, trips, matrix, batched=batched, arrays=arrays))
+    if arrays is not None:
+        arrays.save(binary)
@@ -0,0 +1,116 @@
+import numpy as np
+
+"""
+samplers for discrete distributions that are set up once and then drawn from repeatedly, single values or in batches.
+all random numbers are taken from numpy.random, so seeding numpy.random makes them reproducible.
+"""
+
+
+MAX_CACHED_EXCLUSIONS = 4096  # per sampler
+
+
+class Sampler(object):
+    """
+    draws from values with probabilities p like numpy.random.choice(values, p=p), but the cumulative distribution
+    is only computed once. a single draw consumes the same random number as numpy.random.choice.
+    """
+    def __init__(self, values, p):
+        assert len(values) == len(p)
+        self.values = _to_array(values)
+        self.p = np.asarray(p, dtype=float)
+        self.cdf = np.cumsum(self.p)
+        self.cdf /= self.cdf[-1]
+        self._excluding = dict()
+
+    def indices(self, size=None):
+        """ returns the index of a drawn value, or an array of size drawn indices """
+        return self.cdf.searchsorted(np.random.random_sample(size), side="right")
+
+    def draw(self, size=None):
+        """ returns a drawn value, or an array of size drawn values """
+        return self.values[self.indices(size)]
+
+    def excluding(self, exclude):
+        """
+        returns a sampler of the distribution conditioned on none of the values in exclude being drawn,
+        i.e. with the probabilities of the other values renormalized. the samplers are cached per set of excluded values.
+        """
+        key = frozenset(exclude)
+        if not key:
+            return self
+
+        sampler = self._excluding.get(key)
+        if sampler is None:
+            p = np.where(np.isin(self.values, list(key)), 0.0, self.p)
+            if not p.sum() > 0:
+                raise ValueError("all values with a positive probability are excluded")
+            if len(self._excluding) >= MAX_CACHED_EXCLUSIONS:
+                self._excluding.clear()
+            sampler = self._excluding[key] = Sampler(self.values, p)
+        return sampler
+
+    def draw_excluding(self, excludes):
+        """
+        returns one drawn value per list of excluded values, or per row of a 2d array of excluded values.
+        the draws of equal exclusions are done at once.
+        """
+        values = np.empty(len(excludes), dtype=self.values.dtype)
+        if isinstance(excludes, np.ndarray):
+            if len(excludes) > 0:
+                # sort the rows to find the groups of equal rows
+                order = np.lexsort(excludes.T[::-1])
+                rows = excludes[order]
+                bounds = np.concatenate([[0], np.flatnonzero(np.any(rows[1:] != rows[:-1], axis=1)) + 1, [len(rows)]])
+                for first, last in zip(bounds[:-1], bounds[1:]):
+                    values[order[first:last]] = self.excluding(rows[first].tolist()).draw(last - first)
+            return values
+
+        rows = dict()
+        for i, key in enumerate(frozenset(e) for e in excludes):
+            rows.setdefault(key, []).append(i)
+        for key, r in rows.items():
+            values[r] = self.excluding(key).draw(len(r))
+        return values
+
+
+class AliasSampler(object):
+    """
+    draws from values with probabilities p in constant time per draw, independent of the number of values,
+    using an alias table (Vose's method). each draw consumes one random integer and one uniform random number.
+    """
+    def __init__(self, values, p):
+        assert len(values) == len(p)
+        self.values = _to_array(values)
+
+        n = len(p)
+        scaled = np.asarray(p, dtype=float) * n / np.sum(p)
+        self.prob = np.ones(n)
+        self.alias = np.arange(n)
+
+        small = [i for i in range(n) if scaled[i] < 1]
+        large = [i for i in range(n) if scaled[i] >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] += scaled[s] - 1
+            (small if scaled[l] < 1 else large).append(l)
+        # the remaining entries keep probability 1, up to rounding errors
+
+    def indices(self, size=None):
+        """ returns the index of a drawn value, or an array of size drawn indices """
+        i = np.random.randint(len(self.prob), size=size)
+        return np.where(np.random.random_sample(size) < self.prob[i], i, self.alias[i])
+
+    def draw(self, size=None):
+        """ returns a drawn value, or an array of size drawn values """
+        return self.values[self.indices(size)]
+
+
+def _to_array(values):
+    if all(isinstance(v, (bool, int, float)) for v in values):
+        return np.array(values)
+    # e.g. enums or lists, which must not become an additional dimension of the array
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
@@ -0,0 +1,286 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy
+
+
+"""
+benchmarks the instance generators of this repository with fixed seeds across ladders of instance sizes:
+- ewgt: EWGT-2017 Generator.generate and Instance.store, the size being the number of customers
+- rw: MobilityOffers/RW DistanceMatrix, create_company, prepare_trips and the lines of createMobilityOfferInstance,
+  the size being the number of employees
+- ag: MobilityOffers/AG Generator.generate, the size being the number of demands
+
+each case runs in its own python process, once timed per repetition and once with tracemalloc for the peak of the
+traced memory of each phase. the results are compared with the stored baseline, a case is flagged as regression if its
+total time or memory peak exceeds the one of the baseline by more than the tolerance (and the minimum difference).
+a case that fails is reported and skipped. with regressions or failed cases, the exit code is 1.
+
+example: python benchmarks/benchmark.py --ladder quick
+         python benchmarks/benchmark.py --ladder full --save-baseline
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EWGT_GENERATOR = os.path.join(ROOT, "EWGT-2017", "instanceGenerator.py")
+RW_DIRECTORY = os.path.join(ROOT, "MobilityOffers", "RW", "instanceGenerator")
+AG_GENERATOR = os.path.join(ROOT, "MobilityOffers", "AG", "instanceGenerator.py")
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+SEED = 42
+AG_PARAMETERS = (2, 40, 60)  # longDurationProbability, fleetUtilization, vehicleUsageProbability
+
+LADDERS = {
+    "quick": {"ewgt": [10, 30], "rw": [10, 100], "ag": [200, 1000]},
+    "full": {"ewgt": [10, 30, 100, 300], "rw": [10, 100, 1000, 10000], "ag": [200, 1000, 5000, 20000]},
+}
+# the instance sizes grow quadratically in the number of employees or demands (the number of vehicles grows with them),
+# the largest cases of the full ladder take about an hour with tracemalloc
+
+TOLERANCE = 0.25  # relative increase of time or memory flagged as regression
+MIN_SECONDS = 0.25  # smaller increases of the time are never flagged, cases below a second vary by more than 50% between runs
+MIN_BYTES = 1024 * 1024
+BASELINE_REPEAT = 5  # minimum number of timed runs per case of a saved baseline
+
+
+def loadModule(filename, name):
+    spec = importlib.util.spec_from_file_location(name, filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Measurement(object):
+    """ the time, or with memory=True the tracemalloc peak, of each phase of one run of a case """
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.values = dict()
+        self.sizes = dict()
+
+    @contextmanager
+    def phase(self, name):
+        if self.memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.memory:
+                self.values[name] = tracemalloc.get_traced_memory()[1]
+            else:
+                self.values[name] = time.perf_counter() - start
+
+
+def benchmarkEWGT(size, seed, measurement, directory):
+    module = loadModule(EWGT_GENERATOR, "ewgtInstanceGenerator")
+    random.seed(seed)
+    g = module.Generator()
+    g.nmbCustomers = size
+    g.modesOfTransport = module.createModeOfTransportList()
+    with measurement.phase("generate"):
+        inst = g.generate()
+    inst.name = "benchmark"
+    # the generator joins paths with a backslash, so the instance is stored relative to the working directory
+    os.chdir(directory)
+    with measurement.phase("store"):
+        inst.store("instances")
+    measurement.sizes["nodes"] = len(inst.nodes)
+    measurement.sizes["moveOptions"] = len(inst.moveOptions)
+
+
+def benchmarkRW(size, seed, measurement, directory):
+    sys.path.insert(0, RW_DIRECTORY)
+    from distancematrix import DistanceMatrix, MoT
+    from entities import create_company
+    from generate_instance import prepare_trips, OFFICES
+    from mobilityOfferGenerator import iterMobilityOfferInstance
+
+    numpy.random.seed(seed)
+    random.seed(seed)
+    with measurement.phase("matrix"):
+        matrix = DistanceMatrix()
+    with measurement.phase("company"):
+        company = create_company(size, car_types=3, ecar_types=3, offices=OFFICES)
+    with measurement.phase("trips"):
+        trips = prepare_trips(company.employees, matrix)
+    # the lines createMobilityOfferInstance joins, without keeping them: the number of offers grows quadratically
+    # with the number of employees (one offer per vehicle), so large instances take several GB as one string
+    with measurement.phase("offers"):
+        nmbBytes = sum(len(line) for line in iterMobilityOfferInstance(company, MoT.manager.to_list(), trips, matrix))
+    measurement.sizes["trips"] = len(trips)
+    measurement.sizes["bytes"] = nmbBytes
+
+
+def benchmarkAG(size, seed, measurement, directory):
+    module = loadModule(AG_GENERATOR, "agInstanceGenerator")
+    module.INSTANCE_DIRECTORY = directory
+    with measurement.phase("generate"):
+        instanceName, _ = module.generateInstance((size,) + AG_PARAMETERS, seed=seed)
+    measurement.sizes["bytes"] = os.path.getsize(os.path.join(directory, instanceName + module.INSTANCE_FILE_ENDING))
+
+
+CASES = {"ewgt": benchmarkEWGT, "rw": benchmarkRW, "ag": benchmarkAG}
+
+
+def runCase(case, size, seed, memory):
+    """ runs one case in this process, returns the time or memory peak of each phase and the sizes of the instance """
+    measurement = Measurement(memory)
+    directory = tempfile.mkdtemp(prefix="benchmark-")
+    cwd = os.getcwd()
+    if memory:
+        tracemalloc.start()
+    try:
+        CASES[case](size, seed, measurement, directory)
+    finally:
+        if memory:
+            tracemalloc.stop()
+        os.chdir(cwd)
+        shutil.rmtree(directory, ignore_errors=True)
+    return {"values": measurement.values, "sizes": measurement.sizes}
+
+
+def runCaseProcess(case, size, seed, memory):
+    """ runs one case in a new python process, so that every case starts with the same (empty) state """
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        output = f.name
+    try:
+        command = [sys.executable, os.path.abspath(__file__), "--run-case", case, str(size), "--seed", str(seed),
+                   "--output", output] + (["--memory"] if memory else [])
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        with open(output) as f:
+            return json.load(f)
+    finally:
+        os.remove(output)
+
+
+def benchmark(case, size, seed=SEED, repeat=1, memory=True):
+    """ returns the result of one case: the fastest time of each phase over all repetitions, the memory peaks and sizes """
+    runs = [runCaseProcess(case, size, seed, memory=False) for _ in range(repeat)]
+    seconds = {name: min(run["values"][name] for run in runs) for name in runs[0]["values"]}
+    result = {"case": case, "size": size, "seed": seed, "repeat": repeat, "seconds": seconds,
+              "totalSeconds": sum(seconds.values()), "sizes": runs[0]["sizes"]}
+    if memory:
+        peaks = runCaseProcess(case, size, seed, memory=True)["values"]
+        result["peakBytes"] = peaks
+        result["maxPeakBytes"] = max(peaks.values())
+    return result
+
+
+def getKey(result):
+    return result["case"] + "/" + str(result["size"])
+
+
+def findRegressions(result, baseline, tolerance=TOLERANCE):
+    """ returns a message for each measure of the result that is worse than the one of the baseline """
+    regressions = []
+    measures = [("totalSeconds", MIN_SECONDS, "{:.3f}s"), ("maxPeakBytes", MIN_BYTES, "{:.0f}B")]
+    for measure, minDifference, valueFormat in measures:
+        if measure not in result or measure not in baseline:
+            continue
+        value, reference = result[measure], baseline[measure]
+        if value > reference * (1 + tolerance) and value - reference > minDifference:
+            regressions.append(measure + " " + valueFormat.format(value) + " > baseline " + valueFormat.format(reference)
+                               + " (+" + "{:.0f}".format(100 * (value / reference - 1)) + "%)")
+    return regressions
+
+
+def getEnvironment():
+    return {"python": platform.python_version(), "numpy": numpy.__version__, "platform": platform.platform(),
+            "processor": platform.processor(), "cpus": os.cpu_count()}
+
+
+def loadBaseline(filename):
+    if not os.path.exists(filename):
+        return {"environment": None, "results": {}}
+    with open(filename) as f:
+        return json.load(f)
+
+
+def saveBaseline(filename, baseline, results):
+    """ replaces the results of the baseline by the given ones, keeping the results of the other cases """
+    baseline["environment"] = getEnvironment()
+    for result in results:
+        baseline["results"][getKey(result)] = result
+    with open(filename, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+
+
+def run(cases, ladder, seed=SEED, repeat=1, memory=True, baselineFile=BASELINE_FILE, save=False, tolerance=TOLERANCE):
+    """
+    benchmarks the given cases across the ladder, with save=True each result is stored as soon as it is measured,
+    taking the fastest of at least BASELINE_REPEAT runs
+    """
+    if save:
+        repeat = max(repeat, BASELINE_REPEAT)
+    baseline = loadBaseline(baselineFile)
+    saved = loadBaseline(baselineFile)
+    results, nmbRegressions, nmbFailures = [], 0, 0
+    for case in cases:
+        for size in LADDERS[ladder][case]:
+            try:
+                result = benchmark(case, size, seed=seed, repeat=repeat, memory=memory)
+            except subprocess.CalledProcessError as e:
+                # the traceback of the case is on stderr already, the remaining cases are still measured
+                nmbFailures += 1
+                print("{:<5} {:>6} FAILED (exit code {:})".format(case, size, e.returncode), flush=True)
+                continue
+            results.append(result)
+
+            line = "{:<5} {:>6} {:8.3f}s".format(case, size, result["totalSeconds"])
+            if memory:
+                line += " {:8.1f}MB".format(result["maxPeakBytes"] / 1024 / 1024)
+            line += "  " + " ".join("{:}={:.3f}s".format(name, s) for name, s in result["seconds"].items())
+            reference = baseline["results"].get(getKey(result))
+            if reference is not None:
+                regressions = findRegressions(result, reference, tolerance)
+                nmbRegressions += len(regressions)
+                line += "".join("\n      REGRESSION " + r for r in regressions)
+            print(line, flush=True)
+            if save:
+                saveBaseline(baselineFile, saved, [result])
+
+    if save:
+        print("baseline saved to " + baselineFile)
+    return results, nmbRegressions, nmbFailures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmarks the instance generators across ladders of instance sizes")
+    parser.add_argument("--cases", nargs="+", choices=sorted(CASES), default=["ewgt", "rw", "ag"], help="generators to benchmark")
+    parser.add_argument("--ladder", choices=sorted(LADDERS), default="quick", help="instance sizes (default: quick)")
+    parser.add_argument("--seed", type=int, default=SEED, help="seed of all cases")
+    parser.add_argument("--repeat", type=int, default=1, help="number of timed runs per case, the fastest one counts")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run of each case")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline file to compare with (and save to)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store the results as (part of) the baseline, with at least " + str(BASELINE_REPEAT) + " timed runs per case")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="relative increase flagged as regression")
+    parser.add_argument("--run-case", nargs=2, metavar=("CASE", "SIZE"), help=argparse.SUPPRESS)
+    parser.add_argument("--memory", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        result = runCase(args.run_case[0], int(args.run_case[1]), args.seed, args.memory)
+        with open(args.output, 'w') as f:
+            json.dump(result, f)
+        sys.exit(0)
+
+    _, nmbRegressions, nmbFailures = run(args.cases, args.ladder, seed=args.seed, repeat=args.repeat, memory=not args.no_memory,
+                                         baselineFile=args.baseline, save=args.save_baseline, tolerance=args.tolerance)
+    if nmbFailures:
+        print(str(nmbFailures) + " failed case(s)")
+    if nmbRegressions:
+        print(str(nmbRegressions) + " regression(s)")
+    if nmbFailures or nmbRegressions:
+        sys.exit(1)
@@ -0,0 +1,302 @@
+from functools import cached_property
+import numpy
+import os
+
+
+# A reader for the instances created by the generators of this repository:
+# - EWGT-2017 instance directories (csv files, and the .npy files written by Instance.store(..., binary=True))
+# - MobilityOffers/RW mobility offer instances (.mo.input files, and the .npy columns written
+#   by writeMobilityOfferInstance(..., binary=...))
+# - MobilityOffers/AG mobility offer instances (.mo.input files)
+# Every table is loaded into typed numpy arrays on its first access only. If binary .npy files exist,
+# they are memory-mapped instead of parsing the csv or text files, so nothing is copied until it is used.
+#
+# Usage:
+#   for inst in loadInstances(paths):
+#       inst.moveCost(fromNode, toNode, mot)      # EWGT
+#       inst.getOffers(d)["cost"]                 # RW and AG
+
+
+nodeTypes = {"NodeType.StartDepot": 1, "NodeType.EndDepot": 2, "NodeType.RechargingStation": 3, "NodeType.Customer": 4}
+nodeColumns = ["coordinateX", "coordinateY", "serviceDuration", "twBeginning", "twEnd", "type"]
+
+def loadInstance(path):
+    """ Returns a lazily loaded instance for an EWGT instance directory or a RW or AG .mo.input file """
+    if os.path.isdir(path) or os.path.exists(path + "\\nodes.csv"):
+        return EWGTInstance(path)
+    with open(path) as f:
+        nmbHeaderNumbers = len(f.readline().split())
+    if nmbHeaderNumbers == 4:
+        return RWInstance(path)
+    if nmbHeaderNumbers == 2:
+        return AGInstance(path)
+    raise LoaderException("Unknown instance format: '" + path + "'")
+
+def loadInstances(paths):
+    """ Yields a lazily loaded instance for each of the given paths """
+    for path in paths:
+        yield loadInstance(path)
+
+def readCSV(filename, sep=";"):
+    """ Returns the columns of a csv file with a header line as a dictionary of arrays by column name """
+    with open(filename) as f:
+        header = f.readline().strip().split(sep)
+        rows = [line.split(sep) for line in f.read().splitlines() if line]
+    return {name: parseColumn(values) for name, values in zip(header, zip(*rows))}
+
+def parseColumn(values):
+    """ Returns a column of strings as an int, float, bool or string array, whichever fits all values """
+    for dtype in (numpy.int64, numpy.float64):
+        try:
+            return numpy.array(values, dtype=dtype)
+        except ValueError:
+            pass
+    if all(v in ("True", "False") for v in values):
+        return numpy.array([v == "True" for v in values])
+    return numpy.array(values)
+
+def readMatrixCSV(filename, sep=";"):
+    """ Returns the matrix of a csv file without header, True and False are read as booleans """
+    with open(filename) as f:
+        rows = [line.split(sep) for line in f.read().splitlines() if line]
+    if rows and rows[0][0] in ("True", "False"):
+        return numpy.array(rows) == "True"
+    return numpy.array(rows, dtype=numpy.int64)
+
+class EWGTInstance:
+    """ An instance directory written by EWGT-2017/instanceGenerator.py.
+        Nodes are indexed by their node index (replicated nodes included), modes of transport by their index.
+    """
+    def __init__(self, dir):
+        self.dir = dir
+
+    def getFile(self, name):
+        """ Returns the file name of a file of the instance, the generator joins paths with a backslash """
+        filename = os.path.join(self.dir, name)
+        if os.path.exists(filename):
+            return filename
+        return self.dir + "\\" + name
+
+    def load(self, name):
+        """ Memory-maps the binary file name.npy """
+        return numpy.load(self.getFile(name + ".npy"), mmap_mode="r")
+
+    @cached_property
+    def isBinary(self):
+        return os.path.exists(self.getFile("moveOptions-cost.npy"))
+
+    @cached_property
+    def general(self):
+        return {name: column[0].item() for name, column in readCSV(self.getFile("general.csv")).items()}
+
+    @cached_property
+    def modesOfTransport(self):
+        return readCSV(self.getFile("modesOfTransport.csv"))
+
+    @cached_property
+    def nodes(self):
+        """ The node columns by name, the type is given by the value of NodeType """
+        if self.isBinary:
+            return {name: self.load("nodes-" + name) for name in nodeColumns}
+        columns = readCSV(self.getFile("nodes.csv"))
+        columns["type"] = numpy.array([nodeTypes[t] for t in columns["type"]])
+        return columns
+
+    @cached_property
+    def moveOptions(self):
+        """ The (distance, duration, cost) tensors of shape (physical nodes x physical nodes x modes of transport)
+            and the index of the physical node of each node
+        """
+        if self.isBinary:
+            return (self.load("moveOptions-distance"), self.load("moveOptions-duration"), self.load("moveOptions-cost"),
+                    self.load("moveOptions-physicalNodeIndices"))
+
+        with open(self.getFile("moveOptions.csv")) as f:
+            header = f.readline().strip().split(";")
+            table = numpy.loadtxt(f, delimiter=";", ndmin=2)
+        columns = {name: table[:, i] for i, name in enumerate(header)}
+        fromNode, toNode, mot = (columns[name].astype(numpy.int64) for name in ("fromNode", "toNode", "modeOfTransport"))
+        nmbNodes, nmbMots = max(fromNode.max(), toNode.max()) + 1, mot.max() + 1
+        tensors = []
+        for name in ("distance", "duration", "cost"):
+            tensor = numpy.zeros((nmbNodes, nmbNodes, nmbMots))
+            tensor[fromNode, toNode, mot] = columns[name]
+            tensors.append(tensor)
+        return tuple(tensors) + (numpy.arange(nmbNodes),)
+
+    def moveDistance(self, fromNode, toNode, mot):
+        distance, _, _, p = self.moveOptions
+        return distance[p[fromNode], p[toNode], mot]
+
+    def moveDuration(self, fromNode, toNode, mot):
+        _, duration, _, p = self.moveOptions
+        return duration[p[fromNode], p[toNode], mot]
+
+    def moveCost(self, fromNode, toNode, mot):
+        """ Returns the cost of moving from fromNode to toNode with mode of transport mot, also for arrays of indices """
+        _, _, cost, p = self.moveOptions
+        return cost[p[fromNode], p[toNode], mot]
+
+    def getNodeInfoMatrix(self, name):
+        """ Returns a node info matrix by the name of its csv file without extension,
+            e.g. motDependentNodeInfos-isReachable (modes of transport x nodes)
+            or userDependentNodeInfos-isVisitingAllowed (nodes x users)
+        """
+        if self.isBinary:
+            return self.load(name)
+        return readMatrixCSV(self.getFile(name + ".csv"))
+
+    @cached_property
+    def isReachable(self):
+        return self.getNodeInfoMatrix("motDependentNodeInfos-isReachable")
+
+    @cached_property
+    def nmbVehicles(self):
+        return self.getNodeInfoMatrix("motDependentNodeInfos-nmbVehicles")
+
+    @cached_property
+    def rechargingCost(self):
+        return self.getNodeInfoMatrix("motDependentNodeInfos-rechargingCost")
+
+    @cached_property
+    def isVisitingAllowed(self):
+        return self.getNodeInfoMatrix("userDependentNodeInfos-isVisitingAllowed")
+
+class MobilityOfferInstance:
+    """ A mobility offer instance (.mo.input file) with the offers of all demands stored in one array per offer column.
+        The offers of demand d are the entries demandOffsets[d]:demandOffsets[d+1] of the offer columns.
+        Subclasses read the tables from the demand lines with readTables(demandLines).
+    """
+    offerColumns = []
+    nmbHeaderLines = 0  # lines between the header line and the demand lines
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    @cached_property
+    def header(self):
+        with open(self.filename) as f:
+            return [int(v) for v in f.readline().split()]
+
+    @property
+    def nmbDemands(self):
+        return self.header[1]
+
+    @property
+    def nmbOffers(self):
+        return int(self.demandOffsets[-1])
+
+    def getBinaryFile(self, column):
+        return os.path.splitext(self.filename)[0] + "-" + column + ".npy"
+
+    def loadBinary(self, column):
+        return numpy.load(self.getBinaryFile(column), mmap_mode="r")
+
+    @cached_property
+    def isBinary(self):
+        return os.path.exists(self.getBinaryFile("demandOffsets"))
+
+    @cached_property
+    def tables(self):
+        """ Returns the demand offsets and the offer columns by name, memory-mapped if the binary files exist """
+        if self.isBinary:
+            return self.loadBinary("demandOffsets"), {name: self.loadBinary("offer" + name[0].upper() + name[1:])
+                                                      for name in self.offerColumns}
+        _, demandLines = self.readDemandLines(self.nmbHeaderLines)
+        return self.readTables(demandLines)
+
+    @property
+    def demandOffsets(self):
+        return self.tables[0]
+
+    @property
+    def offers(self):
+        return self.tables[1]
+
+    def getOffers(self, d):
+        """ Returns the offer columns of demand d as views """
+        first, last = self.demandOffsets[d], self.demandOffsets[d + 1]
+        return {name: column[first:last] for name, column in self.offers.items()}
+
+    def readDemandLines(self, nmbHeaderLines):
+        with open(self.filename) as f:
+            lines = f.read().splitlines()
+        return lines[1:nmbHeaderLines + 1], [line for line in lines[nmbHeaderLines + 1:] if line]
+
+class RWInstance(MobilityOfferInstance):
+    """ A mobility offer instance written by MobilityOffers/RW/instanceGenerator.
+        Header: nmbCars nmbDemands nmbOffers nmbMots, offers: cost start end motIdx.
+    """
+    offerColumns = ["cost", "start", "end", "motIdx"]
+
+    @property
+    def nmbCars(self):
+        return self.header[0]
+
+    @property
+    def nmbMots(self):
+        return self.header[3]
+
+    @property
+    def nmbHeaderLines(self):
+        return self.nmbMots
+
+    @cached_property
+    def mots(self):
+        """ The mot lines as columns id, type, nmbAvailable and startIndex """
+        names = ["id", "type", "nmbAvailable", "startIndex"]
+        if self.isBinary:
+            return {name: self.loadBinary("mot" + name[0].upper() + name[1:]) for name in names}
+        motLines, _ = self.readDemandLines(self.nmbMots)
+        return {name: parseColumn(values) for name, values in zip(names, zip(*(line.split() for line in motLines)))}
+
+    def readTables(self, demandLines):
+        nmbOffers, offers = [], []
+        for line in demandLines:
+            n, _, rest = line.partition(" ")
+            nmbOffers.append(int(n))
+            offers.append(rest)
+        values = numpy.array(" ".join(offers).split(), dtype=numpy.float64).reshape(-1, 4)
+        demandOffsets = numpy.concatenate([[0], numpy.cumsum(nmbOffers, dtype=numpy.int64)])
+        columns = {"cost": values[:, 0]}
+        for i, name in enumerate(self.offerColumns[1:], 1):
+            columns[name] = values[:, i].astype(numpy.int64)
+        return demandOffsets, columns
+
+class AGInstance(MobilityOfferInstance):
+    """ A mobility offer instance written by MobilityOffers/AG/instanceGenerator.py.
+        Header: nmbVehicles nmbDemands, demands: creation date, offers: cost twStart twEnd dueDate vehicleIndex.
+    """
+    offerColumns = ["cost", "twStart", "twEnd", "dueDate", "vehicleIndex"]
+
+    @property
+    def nmbVehicles(self):
+        return self.header[0]
+
+    @property
+    def demandCreationDate(self):
+        return self.tables[2]
+
+    def readTables(self, demandLines):
+        values = numpy.array(" ".join(demandLines).split(), dtype=numpy.int64)
+
+        # walk the demands to find the positions of the creation date and the number of offers of each demand
+        demandPositions = numpy.zeros(len(demandLines), dtype=numpy.int64)
+        position = 0
+        for d in range(len(demandLines)):
+            demandPositions[d] = position
+            position += 2 + 5 * int(values[position + 1])
+
+        isOffer = numpy.ones(len(values), dtype=bool)
+        isOffer[demandPositions] = False
+        isOffer[demandPositions + 1] = False
+        offers = values[isOffer].reshape(-1, 5)
+        demandOffsets = numpy.concatenate([[0], numpy.cumsum(values[demandPositions + 1])])
+        columns = {name: offers[:, i] for i, name in enumerate(self.offerColumns)}
+        return demandOffsets, columns, values[demandPositions]
+
+class LoaderException(BaseException):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)